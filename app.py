@@ -1,24 +1,78 @@
+import importlib.util
 import os
 
-from crypto_utils.my_crypto import main as mycrypto
-from stock_utils.stock_prices import main as mystock
+from snapshot import SnapshotRefresher
+from portfolio_history import PortfolioHistory
+from valuation import CURRENCIES, SUMMARY_ROWS, VALUE_COLUMNS
 from send_discord import send_discord_message
+from metrics import METRICS
+from live import LiveFeed, LiveView
+from google_sheet import sheet_ids
+from quote_cache import QuoteCache
 
 # Run this app with `python app.py` and
 # visit http://127.0.0.1:8050/ in your web browser.
-from dash import Dash, dcc, html, Input, Output, State, dash_table
+from dash import Dash, dcc, html, Input, Output, State, dash_table, ctx, Patch, no_update
+from dash.dash_table.Format import Format, Group, Scheme
 import dash_daq as daq
-import plotly.express as px
 from dash.exceptions import PreventUpdate
+from flask import Response
 import pandas as pd
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
-sheet_id = os.environ.get("ASSET_GOOGLE_SHEET_ID")
+# one or more portfolios: ASSET_GOOGLE_SHEET_IDS (comma separated) or ASSET_GOOGLE_SHEET_ID
+try:
+    SHEET_IDS = sheet_ids()
+except ValueError:
+    SHEET_IDS = [None]
 
-app = Dash(__name__, external_stylesheets=external_stylesheets)
+# gzip responses when flask-compress is installed
+COMPRESS = importlib.util.find_spec("flask_compress") is not None
+
+app = Dash(__name__, external_stylesheets=external_stylesheets, compress=COMPRESS)
 app.title = "Sync.h Asset Portfolio"
 server = app.server
 
+# every portfolio refreshes on its own thread; quotes they share are fetched once (see
+# quote_cache.SingleFlight)
+history = PortfolioHistory()
+refreshers = {
+    s: SnapshotRefresher(s, history=history, scope=s if len(SHEET_IDS) > 1 else "all")
+    for s in SHEET_IDS
+}
+for r in refreshers.values():
+    if r.sheet_id is not None:
+        r.start()
+refresher = refreshers[SHEET_IDS[0]]  # default portfolio
+live_feed = LiveFeed(refreshers.values())
+# LiveView per rendered table key, so a browser is only patched against the rows it shows
+live_views = QuoteCache(maxsize=16, ttl={}, default_ttl=float("inf"))
+LIVE_UPDATE_MS = int(os.environ.get("ASSET_LIVE_UPDATE_MS", 2000))
+# rendered table / figure payloads by (sheet, snapshot digest or refresh time), so repeat views
+# and other tabs on the same numbers skip the concat and plotly work
+renders = QuoteCache(maxsize=32, ttl={}, default_ttl=3600)
+
+# formatting happens in the browser; the table only ships raw numbers. no sorting: live patches
+# address cells by row index, which only holds in the order the table was rendered in
+NUMBER_FORMATS = {
+    "amount": Format(precision=6, scheme=Scheme.decimal_or_exponent),
+    "krw": Format(precision=0, scheme=Scheme.fixed, group=Group.yes),
+    "usd": Format(precision=2, scheme=Scheme.fixed, group=Group.yes),
+    "price": Format(precision=6, scheme=Scheme.decimal_or_exponent),
+}
+# ASSET_CURRENCIES adds a column per extra reporting currency, formatted like usd
+EXTRA_COLUMNS = [c.lower() for c in CURRENCIES if c not in ("KRW", "USD")]
+TABLE_COLUMNS = [{"name": c, "id": c} for c in ("class", "symbol")] + [
+    {"name": c, "id": c, "type": "numeric", "format": NUMBER_FORMATS.get(c, NUMBER_FORMATS["usd"])}
+    for c in VALUE_COLUMNS + EXTRA_COLUMNS
+]
+
+
+@server.route("/metrics")
+def metrics():
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+
 app.layout = html.Div([
     html.H1("Asset Portfolio"),
     html.Hr(),
@@ -28,101 +82,159 @@ app.layout = html.Div([
             'margin-right': '10px'
         }),
         daq.BooleanSwitch(id='notify', on=True, style={'display': 'inline-block'}),
+        html.P("Live prices", style={
+            'display': 'inline-block',
+            'margin': '0 10px 0 30px'
+        }),
+        daq.BooleanSwitch(id='live', on=False, style={'display': 'inline-block'}),
     ]),
+    dcc.Interval(id='live-interval', interval=LIVE_UPDATE_MS, disabled=True),
+    dcc.Store(id='live-version'),
+    dcc.Store(id='rendered'),  # render keys of what the browser currently shows
+    dcc.Dropdown(id='portfolio', options=SHEET_IDS, value=SHEET_IDS[0], clearable=False,
+                 style={'display': 'block' if len(SHEET_IDS) > 1 else 'none',
+                        'width': '400px', 'margin': '10px auto'}),
     html.Br(),
     html.Button("Go!", id='go-button'),
+    html.Button("Force refresh", id='refresh-button', style={'margin-left': '10px'}),
     html.Hr(),
     dcc.Loading(
         id="loading-1",
         type="default",
-        children=html.Div(id='output'),
+        children=html.Div(id='output', style={'display': 'none'}, children=[
+            html.P(id='status'),
+            dash_table.DataTable(id='holdings-table', columns=TABLE_COLUMNS),
+            dcc.Graph(id='portfolio-pie'),
+            dcc.Graph(id='history-line'),
+        ]),
     ),
 ],
                       style={'text-align': 'center'})
 
 
-@app.callback(Output(component_id='output', component_property='children'),
-              State(component_id='notify', component_property='on'),
-              Input(component_id='go-button', component_property='n_clicks'))
-def update_output_div(notify, n_clicks):
-    if n_clicks is None:
-        raise PreventUpdate
-
-    rows = mycrypto(sheet_id=sheet_id, notify=False, return_data=True)
-    data = {}
-    for row in rows:
-        if not row:
-            continue
-        float_ = lambda x: float(x.replace(",", "")) if x else x
-        symbol, amount, krw_amount, usd_amount, _, usd_price = row
-        amount = float_(amount)
-        krw_amount = float_(krw_amount)
-        usd_amount = float_(usd_amount)
-        usd_price = float_(usd_price)
-        data[symbol] = {
-            "symbol": symbol,
-            "amount": amount,
-            "krw": krw_amount,
-            "usd": usd_amount,
-            "price": usd_price,
-        }
-    crypto_df = pd.DataFrame(data).T
-    stock_df = mystock(sheet_id=sheet_id, return_data=True)
-
-    crypto_df["class"] = "crypto"
-    stock_df["class"] = "stock"
-
-    total_stake = float(crypto_df.loc["TOTAL", "krw"] + stock_df.loc["TOTAL", "krw"])
-    crypto_profit = float(crypto_df.loc["PROFIT", "krw"])
-    stock_profit = float(stock_df.loc["PROFIT", "krw"])
-    total_profit = crypto_profit + stock_profit
-
+def render_table(snapshot):
+    # (table records, pie figure) for a snapshot
+    crypto_df = snapshot.crypto_df
+    stock_df = snapshot.stock_df
     totals_df = pd.DataFrame({
-        "TOTAL": {
-            "symbol": "TOTAL",
-            "amount": "",
-            "krw": total_stake,
-            "usd": "",
-            "price": "",
-        },
-        "PROFIT": {
-            "symbol": "PROFIT",
-            "amount": "",
-            "krw": total_profit,
-            "usd": "",
-            "price": "",
-        }
-    }).T
-
-    if notify:
-        tao_price = crypto_df.loc["TAO", ["price"]].values[0]
-        eth_price = crypto_df.loc["ETH", ["price"]].values[0]
-
-        message = (f"TAO: ${tao_price:.2f} | ETH: ${eth_price:.2f}\n"
-                   f"Crypto: ₩{crypto_profit:,.2f} | Stock: ₩{stock_profit:,.2f}\n"
-                   f"Total Profit: ₩{total_profit:,.2f} | Total Asset: ₩{total_stake:,.2f}")
-        send_discord_message(message)
+        "symbol": ["TOTAL", "PROFIT"],
+        "krw": [snapshot.total_stake, snapshot.total_profit],
+        **{c: [crypto_df.loc["TOTAL", c] + stock_df.loc["TOTAL", c], None] for c in EXTRA_COLUMNS},
+    }, index=["TOTAL", "PROFIT"])
 
     # prepare web
-    padding = pd.DataFrame({c: [""] for c in crypto_df.columns})
+    padding = pd.DataFrame({"symbol": [None]})
     df = pd.concat([crypto_df, padding, stock_df, padding, totals_df])
 
     # set class to first column
-    cols = df.columns.tolist()
-    cols = cols[-1:] + cols[:-1]
-    df = df[cols]
+    df = df[["class", "symbol", *VALUE_COLUMNS, *EXTRA_COLUMNS]]
 
-    portfolio = df[~df['symbol'].isin(["TOTAL", "PROFIT", "INVESTMENT"])]
+    import plotly.express as px  # first render only, keeps worker boot light
 
+    portfolio = df[df['symbol'].notna() & ~df['symbol'].isin(SUMMARY_ROWS)]
     fig = px.pie(portfolio, values='usd', names='symbol', title='Portfolio')
+    return df.to_dict('records'), fig.to_plotly_json()
+
+
+def render_history(refresher):
+    import plotly.express as px
+
+    history = refresher.history.value_over_time(scope=refresher.scope)
+    return px.line(history, y=['total_krw', 'investment_krw'], title='History').to_plotly_json()
+
+
+def cached_render(source, key, func, *args):
+    value = renders.get(source, key)
+    if value is None:
+        value = func(*args)
+        renders.set(source, key, value)
+    return value
+
+
+@app.callback(Output('output', 'style'),
+              Output('status', 'children'),
+              Output('holdings-table', 'data'),
+              Output('portfolio-pie', 'figure'),
+              Output('history-line', 'figure'),
+              Output('rendered', 'data'),
+              Output('live-version', 'data'),
+              State('notify', 'on'),
+              State('portfolio', 'value'),
+              State('rendered', 'data'),
+              Input('go-button', 'n_clicks'),
+              Input('refresh-button', 'n_clicks'))
+def update_output_div(notify, portfolio, rendered, n_clicks, n_refresh):
+    if n_clicks is None and n_refresh is None:
+        raise PreventUpdate
+
+    refresher = refreshers.get(portfolio, refreshers[SHEET_IDS[0]])
+    if ctx.triggered_id == 'refresh-button':
+        snapshot = refresher.refresh(force=True)
+    else:
+        snapshot = refresher.latest()
+
+    if notify:
+        crypto_df = snapshot.crypto_df
+        tao_price = crypto_df.loc["TAO", ["price"]].values[0]
+        eth_price = crypto_df.loc["ETH", ["price"]].values[0]
+
+        message = (f"TAO: ${tao_price:.2f} | ETH: ${eth_price:.2f}\n"
+                   f"Crypto: ₩{snapshot.crypto_profit:,.2f} | Stock: ₩{snapshot.stock_profit:,.2f}\n"
+                   f"Total Profit: ₩{snapshot.total_profit:,.2f} | Total Asset: ₩{snapshot.total_stake:,.2f}")
+        send_discord_message(message)
 
-    return [
-        dash_table.DataTable(df.to_dict('records'), [{
-            "name": i,
-            "id": i
-        } for i in df.columns]),
-        dcc.Graph(figure=fig)
-    ]
+    status = f"Updated {snapshot.age:.0f}s ago"
+    if snapshot.partial:
+        status += f" (partial: no price for {', '.join(snapshot.missing)})"
+    if snapshot.degraded:
+        status += f" | degraded sources: {', '.join(snapshot.degraded)}"
+
+    # only send what differs from what the browser already shows: the table and pie change
+    # with the numbers, the history line with every recorded refresh
+    rendered = rendered or {}
+    keys = {"table": f"{refresher.sheet_id}:{snapshot.digest}",
+            "history": f"{refresher.sheet_id}:{snapshot.created_at}"}
+    records = pie = version = history_fig = no_update
+    if rendered.get("table") != keys["table"]:
+        records, pie = cached_render("table", keys["table"], render_table, snapshot)
+        # one view per table key, shared by every browser showing it: its running totals
+        # already include the board's moves, so it is only built once
+        if live_views.get("table", keys["table"]) is None:
+            live_views.set("table", keys["table"], LiveView(records, snapshot))
+        version = 0  # the table shows snapshot prices; the first live tick brings every board move
+    if rendered.get("history") != keys["history"]:
+        history_fig = cached_render("history", keys["history"], render_history, refresher)
+
+    return {'display': 'block'}, status, records, pie, history_fig, keys, version
+
+
+@app.callback(Output('live-interval', 'disabled'), Input('live', 'on'))
+def toggle_live(on):
+    if on:
+        live_feed.start()
+    return not on
+
+
+@app.callback(Output('holdings-table', 'data', allow_duplicate=True),
+              Output('live-version', 'data', allow_duplicate=True),
+              Input('live-interval', 'n_intervals'),
+              State('live-version', 'data'),
+              State('rendered', 'data'),
+              prevent_initial_call=True)
+def live_update(n_intervals, since, rendered):
+    # only the cells whose price moved since the browser's version go over the wire. every tick
+    # keeps the feed running; it stops by itself once no browser is live
+    live_feed.start()
+    view = live_views.get("table", (rendered or {}).get("table"))
+    if view is None or since is None:
+        raise PreventUpdate
+    cells, version = view.patch(live_feed.board, since)
+    if not cells:
+        return no_update, version
+    table = Patch()
+    for (row, column), value in cells.items():
+        table[row][column] = value
+    return table, version
 
 
 if __name__ == '__main__':
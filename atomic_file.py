@@ -0,0 +1,19 @@
+import contextlib
+import os
+import tempfile
+
+
+@contextlib.contextmanager
+def replace_file(path, mode="w"):
+    # write to a temp file unique to this writer next to `path`, then swap it in. readers see the
+    # old or the new file, never a partial one, and concurrent writers (gunicorn workers
+    # included) don't share temp names: the last complete write wins
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
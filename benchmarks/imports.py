@@ -0,0 +1,68 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# Import-time budget for the entry points. Each module is imported in a fresh interpreter with
+# `-X importtime`; the best of --repeat runs is compared against its budget, and none of the
+# LAZY dependencies may be loaded by the import alone:
+#
+#   python benchmarks/imports.py
+#   python benchmarks/imports.py --scale 2   # slower machine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# module -> seconds
+BUDGETS = {
+    "app": 1.5,
+    "snapshot": 0.6,
+    "crypto_utils.my_crypto": 0.6,
+    "stock_utils.stock_prices": 0.6,
+}
+# only needed for on-chain fallbacks, the CLI output or the first render
+LAZY = ["web3", "eth_abi", "mexc_sdk", "wallstreet", "scipy", "rich", "termcolor", "fire",
+        "plotly.express"]
+
+
+def import_time(module):
+    # (cumulative seconds, loaded module names) for `import module` in a new interpreter
+    check = f"import sys, {module}; print(' '.join(sys.modules))"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", check],
+                          cwd=ROOT, capture_output=True, text=True, check=True)
+    total = None
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or line.endswith("| package"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.strip() == module and not name[1:].startswith(" "):
+            total = int(cumulative) / 1e6
+    return total, set(proc.stdout.split())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time budget check")
+    parser.add_argument("modules", nargs="*", default=list(BUDGETS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every budget")
+    args = parser.parse_args(argv)
+
+    failures = []
+    for module in args.modules:
+        runs = [import_time(module) for _ in range(args.repeat)]
+        seconds = min(t for t, _ in runs)
+        leaked = [m for m in LAZY if m in runs[0][1]]
+        budget = BUDGETS.get(module, 1.0) * args.scale
+        print(f"{module:<26} {seconds * 1000:8.1f} ms  budget {budget * 1000:7.0f} ms"
+              + (f"  eager: {', '.join(leaked)}" if leaked else ""))
+        if seconds > budget:
+            failures.append(f"{module}: {seconds:.3f}s > {budget:.3f}s")
+        if leaked:
+            failures.append(f"{module}: imports {', '.join(leaked)}")
+
+    for f in failures:
+        print(f"OVER BUDGET {f}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
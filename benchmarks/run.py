@@ -0,0 +1,327 @@
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from upstreams import MexcWebsocket, Upstreams, make_portfolio
+
+# Offline refresh benchmarks. Every upstream is served by a local stand-in (see upstreams.py)
+# so the numbers are reproducible and CI never touches live APIs:
+#
+#   python benchmarks/run.py --latency 0.05 --json bench.json
+#   python benchmarks/run.py --baseline bench.json --tolerance 0.25   # exit 1 on regression
+
+SHEET_ID = "bench-sheet"
+PORTFOLIOS = 3  # sheets refreshed together by multi_portfolio; the stand-in serves one sheet to all
+
+
+class LocalSpot:
+    # mexc_sdk.Spot stand-in that asks the local mexc service
+    base_url = None
+
+    def __init__(self, api_key=None, api_secret=None) -> None:
+        pass
+
+    def avg_price(self, symbol):
+        import requests
+        return requests.get(f"{self.base_url}/mexc/api/v3/avgPrice", params={"symbol": symbol}).json()
+
+
+class LocalStock:
+    # wallstreet.Stock stand-in that asks the local yahoo service
+    base_url = None
+
+    def __init__(self, quote) -> None:
+        import requests
+        response = requests.get(f"{self.base_url}/yahoo/v7/finance/quote", params={"symbols": quote})
+        self.price = response.json()["quoteResponse"]["result"][0]["regularMarketPrice"]
+
+
+class Context:
+
+    def __init__(self, upstreams, cache_dir) -> None:
+        self.upstreams = upstreams
+        self.cache_dir = cache_dir
+        self._app = None
+        self._ws = None
+
+        # modules read ASSET_CACHE_DIR at import time
+        os.environ["ASSET_CACHE_DIR"] = cache_dir
+        os.environ.setdefault("MEXC_API_KEY", "bench")
+        os.environ.setdefault("MEXC_SECRET", "bench")
+        os.environ.pop("ASSET_GOOGLE_SHEET_ID", None)  # keep app.py from starting its refresher
+
+        from crypto_utils import my_crypto
+        from stock_utils import stock_prices
+        import us_quotes
+        import dex_screener
+        import fiat_exchange
+        import google_sheet
+        import quote_cache
+        import send_discord
+        import uniswap_price
+
+        base = upstreams.url
+        LocalSpot.base_url = base
+        LocalStock.base_url = base
+        my_crypto.Spot = LocalSpot
+        us_quotes.Stock = LocalStock
+        us_quotes.YAHOO_QUOTE_URL = base + "/yahoo/v7/finance/quote"
+        us_quotes.YAHOO_CHART_URL = base + "/yahoo/v8/finance/chart/{}"
+        my_crypto.MEXC_KLINES_URL = base + "/mexc/api/v3/klines"
+        stock_prices.NAVER_URL = (base + "/naver/sise.nhn?symbol={company_ticker_symbol}"
+                                  "&timeframe=day&count={lookback}&requestType=0")
+        dex_screener.API_URL = base + "/dexscreener/latest/dex/tokens/{}"
+        fiat_exchange.FiatEx.url = base + "/ecb/stats/eurofxref/eurofxref-hist.zip"
+        fiat_exchange.FiatEx.daily_url = base + "/ecb/stats/eurofxref/eurofxref.zip"
+        fiat_exchange.FiatEx.recent_url = base + "/ecb/stats/eurofxref/eurofxref-hist-90d.zip"
+        google_sheet.SHEET_URL = base + "/gviz/spreadsheets/d/{}/gviz/tq?tqx=out:csv"
+        send_discord.discord_webhook = base + "/discord/webhook"
+        send_discord.NOTIFIER.window = 0  # every run posts its notification, none are coalesced
+        uniswap_price.PROVIDER = base + "/rpc"
+        uniswap_price._web3 = None
+
+        self.my_crypto = my_crypto
+        self.stock_prices = stock_prices
+        self.fiat_exchange = fiat_exchange
+        self.google_sheet = google_sheet
+        self.quote_cache = quote_cache
+        self.send_discord = send_discord
+
+    @property
+    def app(self):
+        if self._app is None:
+            import app
+            app.refresher.sheet_id = SHEET_ID
+            self._app = app
+        return self._app
+
+    def clear_caches(self):
+        self.quote_cache.QUOTE_CACHE.clear()
+        self.google_sheet._parsed.clear()
+
+    def clear_ecb_store(self):
+        for f in glob.glob(os.path.join(self.cache_dir, "ecb-rates.*")):
+            os.remove(f)
+
+    def live(self):
+        # render the table once and stream mexc prices from a local websocket into the board
+        if self._ws is None:
+            self._ws = MexcWebsocket().start()
+            self.app.live_feed.stream.url = self._ws.url
+            self.live_shown = self.rendered(self.click("go-button"))
+            self.app.live_feed.start()
+        board = self.app.live_feed.board
+        deadline = time.monotonic() + 10
+        while board.get(("crypto", "ETH")) is None:
+            assert time.monotonic() < deadline, "no prices from the websocket stand-in"
+            time.sleep(0.01)
+        return board
+
+    def live_tick(self, since, rendered):
+        # allow_duplicate outputs get a hashed id, so take the registered one
+        output = next(k for k in self.app.app.callback_map if k.startswith("..holdings-table.data"))
+        payload = {
+            "output": output,
+            "outputs": [{"id": "holdings-table", "property": "data"},
+                        {"id": "live-version", "property": "data"}],
+            "inputs": [{"id": "live-interval", "property": "n_intervals", "value": 1}],
+            "state": [{"id": "live-version", "property": "data", "value": since},
+                      {"id": "rendered", "property": "data", "value": rendered}],
+            "changedPropIds": ["live-interval.n_intervals"],
+        }
+        response = self.app.server.test_client().post("/_dash-update-component", json=payload)
+        assert response.status_code == 200, response.status_code
+        return response.get_json()
+
+    def click(self, button, notify=False, rendered=None):
+        # rendered: the render keys the browser holds, as returned by an earlier click
+        output = next(k for k in self.app.app.callback_map if k.startswith("..output.style"))
+        payload = {
+            "output": output,
+            "outputs": [{"id": i, "property": p} for i, p in
+                        (o.rsplit(".", 1) for o in output.strip(".").split("..."))],
+            "inputs": [
+                {"id": "go-button", "property": "n_clicks", "value": 1},
+                {"id": "refresh-button", "property": "n_clicks",
+                 "value": 1 if button == "refresh-button" else None},
+            ],
+            "state": [{"id": "notify", "property": "on", "value": notify},
+                      {"id": "portfolio", "property": "value", "value": None},
+                      {"id": "rendered", "property": "data", "value": rendered}],
+            "changedPropIds": [f"{button}.n_clicks"],
+        }
+        response = self.app.server.test_client().post("/_dash-update-component", json=payload)
+        assert response.status_code == 200, response.status_code
+        return response
+
+    def rendered(self, response):
+        return response.get_json()["response"]["rendered"]["data"]
+
+
+def _fiatex_cold(ctx):
+    ctx.clear_ecb_store()
+    ctx.fiat_exchange.FiatEx()
+
+
+def _fiatex_lookup(ctx):
+    import datetime
+    forex = ctx.fiat_exchange.FiatEx()
+    today = datetime.date.today()
+    for d in range(0, 3650):
+        forex.get_fiat_fx("USD", "KRW", date=today - datetime.timedelta(days=d))
+
+
+def _prepare(ctx):
+    ctx.clear_caches()
+    ctx.fiat_exchange.FiatEx()  # ecb store exists, so only pipelines are measured
+
+
+def _incremental(ctx):
+    # a full refresh, then expire every cached quote: the next refresh can only skip upstreams
+    # by carrying prices over from the previous snapshot
+    ctx.app.refresher.refresh(force=True)
+    ctx.clear_caches()
+
+
+def _multi_portfolio(ctx):
+    # concurrent refreshes share every symbol, so upstream requests should match a single
+    # portfolio apart from the sheet downloads
+    from snapshot import build_snapshot
+
+    with ThreadPoolExecutor(max_workers=PORTFOLIOS) as executor:
+        list(executor.map(build_snapshot, [f"{SHEET_ID}-{i}" for i in range(PORTFOLIOS)]))
+
+
+def _revalue_year(ctx):
+    # a year of daily values from one history request per asset
+    import revalue
+
+    revalue.revalue_sheet(SHEET_ID, days=365)
+
+
+def _cached_view(ctx):
+    # the browser already shows the latest snapshot, so a repeat view only sends the status
+    ctx.shown = ctx.rendered(ctx.click("go-button"))
+
+
+def _live_tick(ctx):
+    # one interval callback that has to patch the cells of the last streamed price change
+    ctx.live_tick(ctx.app.live_feed.board.version - 1, ctx.live_shown)
+
+
+# name -> (setup, run). setup is not timed.
+BENCHMARKS = {
+    "fiatex_cold": (None, _fiatex_cold),
+    "fiatex_warm": (lambda ctx: ctx.fiat_exchange.FiatEx(), lambda ctx: ctx.fiat_exchange.FiatEx()),
+    "fiatex_lookup_10y": (lambda ctx: ctx.fiat_exchange.FiatEx(), _fiatex_lookup),
+    "stock_main": (_prepare, lambda ctx: ctx.stock_prices.main(sheet_id=SHEET_ID, return_data=True)),
+    "crypto_main": (_prepare, lambda ctx: ctx.my_crypto.main(sheet_id=SHEET_ID, return_data=True)),
+    "app_force_refresh": (_prepare, lambda ctx: ctx.click("refresh-button", notify=True)),
+    "multi_portfolio": (_prepare, _multi_portfolio),
+    "app_incremental_refresh": (_incremental, lambda ctx: ctx.app.refresher.refresh()),
+    "app_first_view": (lambda ctx: ctx.app.renders.clear(), lambda ctx: ctx.click("go-button")),
+    "app_cached_view": (_cached_view, lambda ctx: ctx.click("go-button", rendered=ctx.shown)),
+    "app_live_tick": (lambda ctx: ctx.live(), _live_tick),
+    "revalue_year": (_prepare, _revalue_year),
+}
+
+
+def measure(ctx, name, repeat):
+    setup, run = BENCHMARKS[name]
+    walls = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup(ctx)
+        start = time.perf_counter()
+        run(ctx)
+        walls.append(time.perf_counter() - start)
+        ctx.send_discord.NOTIFIER.flush()  # queued notifications go out before the next run
+
+    # one more traced run for request counts and peak memory; tracing skews wall time
+    if setup is not None:
+        setup(ctx)
+    ctx.upstreams.reset()
+    tracemalloc.start()
+    run(ctx)
+    ctx.send_discord.NOTIFIER.flush()  # notifications are posted off-thread; count them too
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    counts = dict(sorted(ctx.upstreams.counts.items()))
+    connections = ctx.upstreams.connections
+
+    return {
+        "wall_s": statistics.median(walls),
+        "wall_min_s": min(walls),
+        "requests": counts,
+        "requests_total": sum(counts.values()),
+        "connections": connections,
+        "peak_kib": peak / 1024,
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key in ("wall_s", "peak_kib"):
+            if result[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name}.{key}: {base[key]:.4g} -> {result[key]:.4g}")
+        if result["requests_total"] > base["requests_total"]:
+            regressions.append(
+                f"{name}.requests_total: {base['requests_total']} -> {result['requests_total']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline refresh benchmarks")
+    parser.add_argument("benchmarks", nargs="*", default=list(BENCHMARKS), help="benchmarks to run")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every upstream request")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of upstream requests answered with 500")
+    parser.add_argument("--crypto", type=int, default=20, help="number of crypto tokens in the sheet")
+    parser.add_argument("--kr", type=int, default=10, help="number of KR stocks in the sheet")
+    parser.add_argument("--us", type=int, default=10, help="number of US stocks in the sheet")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown / growth")
+    args = parser.parse_args(argv)
+
+    sheet, missing = make_portfolio(args.crypto, args.kr, args.us)
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir, Upstreams(latency=args.latency,
+                                                               failure_rate=args.failure_rate,
+                                                               sheet=sheet,
+                                                               missing_tokens=missing) as upstreams:
+        ctx = Context(upstreams, cache_dir)
+        for name in args.benchmarks:
+            results[name] = measure(ctx, name, args.repeat)
+            r = results[name]
+            print(f"{name:<20} wall {r['wall_s'] * 1000:9.1f} ms  requests {r['requests_total']:4d}"
+                  f"  connections {r['connections']:4d}  peak {r['peak_kib']:9.1f} KiB  {r['requests']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,346 @@
+import datetime
+import io
+import json
+import random
+import threading
+import time
+import zipfile
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# local stand-ins for every upstream the refresh path talks to. each service is mounted under
+# its own path prefix so request counts, latency and failures can be set per service
+SERVICES = ("naver", "dexscreener", "ecb", "gviz", "discord", "rpc", "mexc", "yahoo")
+
+ECB_CURRENCIES = ["USD", "JPY", "GBP", "KRW"]
+WETH = "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"
+
+
+def _address(i):
+    return "0x" + f"{i + 1:040x}"
+
+
+def make_portfolio(n_crypto=20, n_kr=10, n_us=10, dex_missing=0.1):
+    # sheet csv in the layout the app expects, plus the token addresses dexscreener should not know
+    rows = ["CLASS,SUBTYPE,ASSET,TICKER,ADDRESS,DECIMALS,AMOUNT"]
+    rows.append("crypto,inv,INVESTMENT,,,,10000000")
+    rows.append(f"crypto,dex,ETH,,{WETH},18,1.5")
+    rows.append(f"crypto,dex,WETH,,{WETH},18,0")
+    rows.append(f"crypto,dex,USDT,,{_address(10**6)},6,500")
+    rows.append(f"crypto,dex,TAO,,{_address(10**6 + 1)},9,12")
+    missing = set()
+    for i in range(n_crypto):
+        if i < n_crypto * dex_missing:
+            missing.add(_address(i).lower())
+        rows.append(f"crypto,dex,TKN{i},,{_address(i)},18,{100 + i}")
+    rows.append("stock,inv,INVESTMENT,,,,5000000")
+    for i in range(n_kr):
+        rows.append(f'stock,kr,KR{i},"{i:06d}",,,{10 + i}')
+    for i in range(n_us):
+        rows.append(f"stock,us,US{i},,,,{1 + i}")
+    return "\n".join(rows) + "\n", missing
+
+
+def make_ecb_history(days=365 * 25, end=None):
+    end = end or datetime.date.today()
+    lines = ["Date," + ",".join(ECB_CURRENCIES) + ","]
+    for d in range(days):
+        date = end - datetime.timedelta(days=d)
+        if date.weekday() >= 5:
+            continue
+        rates = [1.1 + d * 1e-5, 150 + d * 1e-3, 0.85, 1450 + d * 1e-2]
+        lines.append(date.isoformat() + "," + ",".join(f"{r:.4f}" for r in rates) + ",")
+    return "\n".join(lines) + "\n"
+
+
+def make_ecb_daily(date=None):
+    date = date or datetime.date.today()
+    return ("Date, " + ", ".join(ECB_CURRENCIES) + ", \n" + date.strftime("%d %B %Y") +
+            ", 1.1000, 150.0000, 0.8500, 1450.0000, \n")
+
+
+def _zip(name, text):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr(name, text)
+    return buf.getvalue()
+
+
+def make_naver_xml(symbol, count):
+    today = datetime.date.today()
+    items = []
+    for d in range(count, 0, -1):
+        date = (today - datetime.timedelta(days=d)).strftime("%Y%m%d")
+        close = 50000 + d * 10
+        items.append(f'<item data="{date}|{close - 100}|{close + 200}|{close - 300}|{close}|{1000 + d}" />')
+    return ('<?xml version="1.0" encoding="EUC-KR" ?><protocol>'
+            f'<chartdata symbol="{symbol}" name="stock" count="{count}" timeframe="day" '
+            f'precision="0" origintime="19900103">' + "".join(items) + "</chartdata></protocol>")
+
+
+def make_klines(query):
+    # mexc 1d klines between startTime and endTime (ms), at most `limit` of them
+    day = 86400 * 1000
+    start = int(query["startTime"][0]) // day * day
+    end = int(query["endTime"][0])
+    limit = int(query.get("limit", ["500"])[0])
+    opens = range(start, end + 1, day)[:limit]
+    return [[t, "3000", "3100", "2900", f"{3000 + (t // day) % 50}", "1000", t + day - 1, "3000000"]
+            for t in opens]
+
+
+def make_chart(query):
+    # yahoo v8 chart with one close per weekday between period1 and period2 (s)
+    day = 86400
+    start, end = int(query["period1"][0]) // day * day, int(query["period2"][0])
+    stamps = [t + 14 * 3600 for t in range(start, end, day) if (t // day + 3) % 7 < 5]
+    closes = [100.0 + (t // day) % 20 for t in stamps]
+    return {"chart": {"result": [{"timestamp": stamps, "indicators": {"quote": [{"close": closes}]}}]}}
+
+
+V3_POOL_FEES = (3000, 10000)  # fee tiers the factory stand-in has pools for
+
+
+def _rpc_result(request):
+    # answers Multicall3 aggregate3: factories know a pool for every pair at V3_POOL_FEES, every
+    # pool has liquidity, and every quote is 2x the input size. enough to exercise encoding,
+    # decoding, pool discovery and best-price selection
+    from eth_abi import decode, encode
+    from web3 import Web3
+
+    if request["method"] == "eth_chainId":
+        return "0x1"
+    if request["method"] != "eth_call":
+        return None
+    quoter = {
+        bytes(Web3.keccak(text=f"{name}(address,address,uint24,uint256,uint160)")[:4])
+        for name in ("quoteExactInputSingle", "quoteExactOutputSingle")
+    }
+    selector = {name: bytes(Web3.keccak(text=name)[:4])
+                for name in ("getPool(address,address,uint24)", "getPair(address,address)",
+                             "liquidity()", "getReserves()")}
+    pool = "0x" + "11" * 20
+    data = bytes.fromhex(request["params"][0]["data"][2:])
+    calls = decode(["(address,bool,bytes)[]"], data[4:])[0]
+    out = []
+    for _, _, call_data in calls:
+        if call_data[:4] == selector["getPool(address,address,uint24)"]:
+            fee = decode(["address", "address", "uint24"], call_data[4:])[2]
+            out.append((True, encode(["address"], [pool if fee in V3_POOL_FEES else "0x" + "00" * 20])))
+        elif call_data[:4] == selector["getPair(address,address)"]:
+            out.append((True, encode(["address"], [pool])))
+        elif call_data[:4] == selector["liquidity()"]:
+            out.append((True, encode(["uint128"], [10**18])))
+        elif call_data[:4] == selector["getReserves()"]:
+            out.append((True, encode(["uint112", "uint112", "uint32"], [10**21, 10**21, 0])))
+        elif call_data[:4] in quoter:
+            amount = decode(["address", "address", "uint24", "uint256", "uint160"], call_data[4:])[3]
+            out.append((True, encode(["uint256"], [amount * 2])))
+        else:  # v2 router getAmountsOut / getAmountsIn
+            amount, path = decode(["uint256", "address[]"], call_data[4:])
+            out.append((True, encode(["uint256[]"], [[amount * 2] * len(path)])))
+    return "0x" + encode(["(bool,bytes)[]"], [out]).hex()
+
+
+class Upstreams:
+
+    def __init__(self, latency=0.0, failure_rate=0.0, sheet=None, missing_tokens=(), seed=0,
+                 ecb_days=365 * 25) -> None:
+        # latency / failure_rate: a number for every service or a {service: value} dict
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sheet = sheet if sheet is not None else make_portfolio()[0]
+        self.missing_tokens = set(missing_tokens)
+        self.ecb_days = ecb_days
+        self.counts = Counter()
+        self.connections = 0  # tcp connections accepted, to see keep-alive at work
+        self.discord_messages = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ecb_hist = None
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+            self.connections = 0
+            self.discord_messages.clear()
+
+    def _setting(self, value, service):
+        return value.get(service, 0) if isinstance(value, dict) else value
+
+    def _ecb_history(self):
+        if self._ecb_hist is None:
+            self._ecb_hist = _zip("eurofxref-hist.csv", make_ecb_history(self.ecb_days))
+        return self._ecb_hist
+
+    def _respond(self, service, method, path, query, body):
+        if service == "naver":
+            symbol = query["symbol"][0]
+            count = int(query.get("count", ["1"])[0])
+            return 200, "text/xml;charset=EUC-KR", make_naver_xml(symbol, count).encode("euc-kr")
+        if service == "dexscreener":
+            addresses = path.rsplit("/", 1)[-1].split(",")
+            pairs = []
+            for i, address in enumerate(addresses):
+                if address.lower() in self.missing_tokens:
+                    continue
+                base = {"address": address, "symbol": f"T{i}"}
+                pairs.append({"baseToken": base, "quoteToken": {"symbol": "WETH"},
+                              "priceNative": "0.0005", "priceUsd": "1.75"})
+                pairs.append({"baseToken": base, "quoteToken": {"symbol": "USDT"},
+                              "priceNative": "1.74", "priceUsd": "1.74"})
+            return 200, "application/json", json.dumps({"pairs": pairs or None}).encode()
+        if service == "ecb":
+            if path.endswith("eurofxref-hist.zip"):
+                return 200, "application/zip", self._ecb_history()
+            if path.endswith("eurofxref-hist-90d.zip"):
+                return 200, "application/zip", _zip("eurofxref-hist-90d.csv", make_ecb_history(90))
+            return 200, "application/zip", _zip("eurofxref.csv", make_ecb_daily())
+        if service == "gviz":
+            return 200, "text/csv", self.sheet.encode()
+        if service == "discord":
+            self.discord_messages.append(json.loads(body or b"{}").get("content"))
+            return 204, "application/json", b""
+        if service == "rpc":
+            request = json.loads(body)
+            result = {"jsonrpc": "2.0", "id": request["id"], "result": _rpc_result(request)}
+            return 200, "application/json", json.dumps(result).encode()
+        if service == "mexc" and path.endswith("/klines"):
+            return 200, "application/json", json.dumps(make_klines(query)).encode()
+        if service == "mexc":
+            return 200, "application/json", json.dumps({"mins": 5, "price": "3000.12"}).encode()
+        if service == "yahoo" and "/chart/" in path:
+            return 200, "application/json", json.dumps(make_chart(query)).encode()
+        if service == "yahoo":
+            symbols = query.get("symbols", query.get("symbol", [""]))[0].split(",")
+            result = [{"symbol": s, "regularMarketPrice": 100.0 + i} for i, s in enumerate(symbols)]
+            return 200, "application/json", json.dumps({"quoteResponse": {"result": result}}).encode()
+        return 404, "text/plain", b"unknown service"
+
+    def _handler(self):
+        upstreams = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with upstreams._lock:
+                    upstreams.connections += 1
+
+            def _handle(self, method):
+                parsed = urlparse(self.path)
+                service = parsed.path.strip("/").split("/", 1)[0]
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                with upstreams._lock:
+                    upstreams.counts[service] += 1
+                    failed = upstreams._random.random() < upstreams._setting(upstreams.failure_rate, service)
+                time.sleep(upstreams._setting(upstreams.latency, service))
+
+                if failed:
+                    status, content_type, payload = 500, "text/plain", b"injected failure"
+                else:
+                    status, content_type, payload = upstreams._respond(service, method, parsed.path,
+                                                                       parse_qs(parsed.query), body)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+class MexcWebsocket:
+    # mexc spot websocket stand-in (needs `websockets`): after a SUBSCRIPTION every subscribed
+    # pair gets one deals message per `interval` seconds, its price doing a small random walk
+
+    def __init__(self, interval=0.05, price=3000.0, seed=0) -> None:
+        from websockets.sync.server import serve
+
+        self.interval = interval
+        self.price = price
+        self.sent = 0
+        self._random = random.Random(seed)
+        self.server = serve(self._handler, "127.0.0.1", 0)
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self.server.socket.getsockname()[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self, ws):
+        from websockets.exceptions import ConnectionClosed
+
+        channels = []
+        try:
+            while True:
+                try:
+                    request = json.loads(ws.recv(timeout=self.interval))
+                except TimeoutError:
+                    request = None
+                if request and request.get("method") == "SUBSCRIPTION":
+                    channels += request["params"]
+                    ws.send(json.dumps({"id": 0, "code": 0, "msg": ",".join(request["params"])}))
+                elif request and request.get("method") == "PING":
+                    ws.send(json.dumps({"id": 0, "code": 0, "msg": "PONG"}))
+                for channel in channels:
+                    self.price *= 1 + self._random.uniform(-1e-3, 1e-3)
+                    now = int(time.time() * 1000)
+                    ws.send(json.dumps({
+                        "c": channel,
+                        "d": {"deals": [{"S": 1, "p": f"{self.price:.2f}", "t": now, "v": "0.1"}],
+                              "e": "spot@public.deals.v3.api"},
+                        "s": channel.rsplit("@", 1)[-1],
+                        "t": now,
+                    }))
+                    self.sent += 1
+        except ConnectionClosed:
+            pass
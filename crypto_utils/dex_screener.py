@@ -1,19 +1,77 @@
 import requests
 
-API_URL = "https://api.dexscreener.com/latest/dex/tokens/{}"
+from quote_cache import QUOTE_CACHE, QUOTE_FLIGHTS, cached_quote
+from sources import SourceUnavailable, request_timeout, upstream
+import http_client
 
+API_URL = "https://api.dexscreener.com/latest/dex/tokens/{}"
+MAX_ADDRESSES = 30  # dexscreener accepts up to 30 comma separated addresses per request
 
-def get_token_price(address):
-    url = API_URL.format(address)
-    response = requests.get(url)
-    if response.status_code != 200:
-        return None
-    data = response.json()
 
+def _parse_pairs(pairs):
     prices = {}
-    for x in data["pairs"]:
+    for x in pairs:
         quote = x["quoteToken"]["symbol"]
         native_price = x["priceNative"]
         usd_price = x["priceUsd"]
         prices[quote] = {"native": float(native_price), "usd": float(usd_price)}
     return prices
+
+
+@cached_quote("dexscreener", key=lambda address: address.lower())
+def get_token_price(address):
+    url = API_URL.format(address)
+    with upstream("dexscreener") as request:
+        response = http_client.get(url, timeout=request_timeout())
+        if response.status_code != 200:
+            request.fail()
+    if response.status_code != 200:
+        return None
+    data = response.json()
+    if not data["pairs"]:
+        return None
+    return _parse_pairs(data["pairs"])
+
+
+def get_token_prices(addresses):
+    # resolve many tokens at once; returns {address.lower(): prices}. tokens without pairs in the
+    # response are left out so callers can fall back to get_token_price
+    addresses = list(dict.fromkeys(a.lower() for a in addresses))
+    results = {}
+    for address in addresses:
+        prices = QUOTE_CACHE.get("dexscreener", address)
+        if prices is not None:
+            results[address] = prices
+    addresses = [a for a in addresses if a not in results]
+    if addresses:
+        # addresses another portfolio is already fetching are waited for, not requested again
+        results.update(QUOTE_FLIGHTS.do_many("dexscreener", addresses, _fetch_token_prices))
+    return results
+
+
+def _fetch_token_prices(addresses):
+    results = {}
+    for i in range(0, len(addresses), MAX_ADDRESSES):
+        chunk = addresses[i:i + MAX_ADDRESSES]
+        try:
+            with upstream("dexscreener") as request:
+                response = http_client.get(API_URL.format(",".join(chunk)), timeout=request_timeout())
+                if response.status_code != 200:
+                    request.fail()
+        except (requests.RequestException, SourceUnavailable) as e:
+            print(f"dexscreener batch failed: {e!r}")
+            continue
+        if response.status_code != 200:
+            continue
+        pairs = response.json()["pairs"] or []
+
+        by_token = {a: [] for a in chunk}
+        for x in pairs:
+            base = x["baseToken"]["address"].lower()
+            if base in by_token:
+                by_token[base].append(x)
+        for address, token_pairs in by_token.items():
+            if token_pairs:
+                results[address] = _parse_pairs(token_pairs)
+                QUOTE_CACHE.set("dexscreener", address, results[address])
+    return results
@@ -2,57 +2,131 @@ import os
 import re
 import sys
 
+import numpy as np
 import pandas as pd
-from mexc_sdk import Spot
-from rich.console import Console, Text
-from rich.table import Table
-from termcolor import colored
-import fire
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from send_discord import send_discord_message
-from uniswap_price import get_price_calculator
-from dex_screener import get_token_price
+from dex_screener import get_token_price, get_token_prices
 from fiat_exchange import FiatEx
-from google_sheet import open_sheet
+from google_sheet import map_sheets, open_sheet, sheet_ids
+from quote_cache import cached_quote
+from metrics import METRICS
+from sources import guarded, race, request_timeout, upstream
+import http_client
+from portfolio_history import PortfolioHistory
+from valuation import CURRENCIES, add_totals, currency_list
+from rates import RateGraph
+
+# mexc_sdk is imported with the first CryptoEx; web3 (uniswap_price) only once a token has to be
+# priced on-chain, and rich / termcolor / fire only by the CLI
+Spot = None
+
+
+MEXC_KLINES_URL = "https://api.mexc.com/api/v3/klines"
+MAX_KLINES = 1000  # candles per klines request
+
+
+@cached_quote("mexc", key=lambda mexc, pair: pair)
+@guarded("mexc")
+def get_mexc_avg_price(mexc, pair):
+    return float(mexc.avg_price(pair)["price"])
+
+
+def get_mexc_daily_closes(pair, start, end):
+    # daily closes for a mexc spot pair (e.g. ETHUSDT) between two dates, indexed by date.
+    # public market data, so no api key / sdk needed
+    start_ms = int(pd.Timestamp(start).timestamp() * 1000)
+    end_ms = int((pd.Timestamp(end) + pd.Timedelta(days=1)).timestamp() * 1000) - 1
+    candles = []
+    while start_ms <= end_ms:
+        with upstream("mexc") as request:
+            response = http_client.get(MEXC_KLINES_URL,
+                                       params={"symbol": pair, "interval": "1d", "startTime": start_ms,
+                                               "endTime": end_ms, "limit": MAX_KLINES},
+                                       timeout=request_timeout())
+            if response.status_code != 200:
+                request.fail()
+        response.raise_for_status()
+        batch = response.json()
+        candles += batch
+        if len(batch) < MAX_KLINES:
+            break
+        start_ms = batch[-1][0] + 1
+    # [open time, open, high, low, close, volume, ...]
+    closes = pd.Series([float(c[4]) for c in candles], dtype="float64",
+                       index=pd.to_datetime([c[0] for c in candles], unit="ms").normalize())
+    return closes[~closes.index.duplicated(keep="last")].rename_axis("Date")
 
 
 class CryptoEx:
 
-    def __init__(self, asset_info) -> None:
+    def __init__(self, asset_info, symbols=None) -> None:
+        global Spot
+        if Spot is None:
+            from mexc_sdk import Spot
         self.mexc = Spot(api_key=os.environ["MEXC_API_KEY"], api_secret=os.environ["MEXC_SECRET"])
 
         # Some token addresses we'll be using later in this guide
         self.address_book = asset_info[["ASSET", "ADDRESS",
                                         "DECIMALS"]].set_index("ASSET").to_dict(orient="index")
-
-    def get_crypto_fx(self, symbol1, symbol2):
-        if symbol1 in ("ETH", "WETH"):
-            return float(self.mexc.avg_price(symbol1 + symbol2)["price"])
+        # one batched dexscreener lookup for every token in the sheet (or just `symbols`)
+        addresses = [
+            t["ADDRESS"]
+            for s, t in self.address_book.items()
+            if isinstance(t["ADDRESS"], str) and (symbols is None or s in symbols)
+        ]
+        self.dex_prices = get_token_prices(addresses) if addresses else {}
+
+    def get_dex_prices(self, address):
+        key = address.lower()
+        if key not in self.dex_prices:
+            self.dex_prices[key] = get_token_price(address)
+        return self.dex_prices[key]
+
+    def _dex_fx(self, symbol1, symbol2):
         token1 = self.address_book.get(symbol1, None)
-        token2 = self.address_book.get(symbol2, None)
-
-        prices = get_token_price(token1["ADDRESS"])
+        if token1 is None or not isinstance(token1["ADDRESS"], str):
+            return None
+        prices = self.get_dex_prices(token1["ADDRESS"])
         if prices is None:
             print(f"Can't fetch coin price for {symbol1} using dexscreener. Trying UniSwap...")
         elif symbol2 in ("USDT", "USDC", "DAI"):
             return max(p['usd'] for p in prices.values())
         elif symbol2 == "ETH":
-            return prices["WETH"]["native"]
+            return prices.get("WETH", {}).get("native")
         elif symbol2 in prices:
             return prices[symbol2]["native"]
+        return None
 
+    def _uniswap_fx(self, symbol1, symbol2):
+        token1 = self.address_book.get(symbol1, None)
+        token2 = self.address_book.get(symbol2, None)
         if token1 is None or token2 is None:
             print(f"symbol1: {symbol1} or symbol2: {symbol2} is not implemented. Returning 0")
-            return 0
-        token1["symbol"] = symbol1
-        token2["symbol"] = symbol2
+            return None
+        from uniswap_price import get_price_calculator
+
+        token1 = {"address": token1["ADDRESS"], "symbol": symbol1, "decimals": token1["DECIMALS"]}
+        token2 = {"address": token2["ADDRESS"], "symbol": symbol2, "decimals": token2["DECIMALS"]}
         price = get_price_calculator()(token1, token2)
         if isinstance(price, dict):
             price = price["avg"]
         return price
 
+    def get_crypto_fx(self, symbol1, symbol2):
+        # dexscreener first; uniswap is raced in when it hasn't answered within HEDGE_DELAY.
+        # 0 when no source prices the pair before the refresh deadline
+        if symbol1 in ("ETH", "WETH"):
+            attempts = [("mexc", lambda: get_mexc_avg_price(self.mexc, symbol1 + symbol2))]
+            if symbol1 == "ETH" and "WETH" in self.address_book:
+                attempts.append(("dexscreener", lambda: self._dex_fx("WETH", symbol2)))
+        else:
+            attempts = [("dexscreener", lambda: self._dex_fx(symbol1, symbol2)),
+                        ("infura", lambda: self._uniswap_fx(symbol1, symbol2))]
+        return race(*attempts) or 0
+
 
 def format_number(n, c=3, d=2):
     if c == 3:
@@ -61,24 +135,94 @@ def format_number(n, c=3, d=2):
 
 
 def cprint(s, color=None):
+    from termcolor import colored
+
     print(colored(s, color))
 
 
-def main(sheet_id=None, notify=False, return_data=False):
-    if sheet_id is None:
-        sheet_id = os.environ.get("ASSET_GOOGLE_SHEET_ID", None)
-        if sheet_id is None:
-            raise ValueError("sheet_id is not provided")
-    asset_info = open_sheet(sheet_id)
+def value_crypto(asset_info, cex, graph, known=None, currencies=()):
+    # typed float64 valuation indexed by symbol: amount, krw, usd, price (USD), eth, plus a
+    # column per extra currency. every value comes out of one RateGraph resolve, so only tokens
+    # the batched quotes left unpriced cost another request.
+    # known: {symbol: usd price} taken as is instead of asking an upstream
+    known = known or {}
+    asset_info = asset_info[asset_info["AMOUNT"] != 0]
+    symbols = asset_info["ASSET"].to_numpy()
+    amount = asset_info["AMOUNT"].to_numpy(dtype="float64")
+
+    # carried over prices, then the batched dexscreener quotes for holdings without a price of
+    # their own yet (ETH / WETH already come from mexc)
+    for symbol, usd in known.items():
+        graph.add(symbol, "USD", usd)
+    for symbol, is_usd in zip(symbols, asset_info["ASSET"].str.contains("USD")):
+        token = cex.address_book.get(symbol)
+        if is_usd:
+            graph.add(symbol, "USD", 1.0)
+        elif not graph.has_price(symbol) and token is not None and isinstance(token["ADDRESS"], str):
+            graph.add_dex(symbol, cex.dex_prices.get(token["ADDRESS"].lower()))
+
+    # a holding only reachable as some other token's quote side would get that pair's cross
+    # rate, so anything still without its own price goes to the single-token fallback. those
+    # prices go in as direct USD edges, which beat any such longer route
+    unpriced = [s for s in dict.fromkeys(symbols) if not graph.has_price(s)]
+    eth_price = graph.resolve().get("ETH", np.nan) if unpriced else np.nan
+    for symbol in unpriced:
+        usd = cex.get_crypto_fx(symbol, "USDT")
+        if not usd:
+            usd = cex.get_crypto_fx(symbol, "WETH") * eth_price
+        graph.add(symbol, "USD", usd)
+
+    currencies = ["KRW", "USD", "ETH", *[c for c in currencies if c not in ("KRW", "USD", "ETH")]]
+    rates = graph.rates(currencies).reindex(symbols).to_numpy(copy=True)
+    failed = np.isnan(rates[:, 1])
+    rates[failed] = 0
+    values = amount[:, None] * rates
+    df = pd.DataFrame(
+        {
+            "amount": amount,
+            "krw": values[:, 0],
+            "usd": values[:, 1],
+            "price": rates[:, 1],
+            "eth": values[:, 2],
+            **{c.lower(): values[:, i] for i, c in enumerate(currencies) if i > 2},
+        },
+        index=pd.Index(symbols, name="symbol"),
+    )
+    df.attrs["missing"] = list(symbols[failed])  # priced at 0, no source answered
+    return df
+
+
+def main(sheet_id=None, notify=False, return_data=False, assets=None, known=None, currencies=CURRENCIES):
+    # currencies: extra reporting currencies, "EUR,JPY" on the command line
+    currencies = currency_list(currencies)
+    if assets is None:
+        ids = sheet_ids(sheet_id)
+        if len(ids) > 1:
+            # {sheet_id: frame} with return_data
+            return map_sheets(main, ids, return_data, notify=notify, currencies=currencies)
+        assets = open_sheet(ids[0])
+    asset_info = assets
     asset_info = asset_info[asset_info["CLASS"] == "crypto"]
-    total_inv_krw = float(asset_info[asset_info["SUBTYPE"] == "inv"]["AMOUNT"])
+    total_inv_krw = float(asset_info[asset_info["SUBTYPE"] == "inv"]["AMOUNT"].sum())
     asset_info = asset_info[asset_info["SUBTYPE"] == "dex"]
 
-    forex = FiatEx()
-    cex = CryptoEx(asset_info)
+    with METRICS.span("crypto.fx"):
+        forex = FiatEx()
+        priced = asset_info[(asset_info["AMOUNT"] != 0) & ~asset_info["ASSET"].str.contains("USD")]
+        stale = None if known is None else set(priced["ASSET"]) - set(known)
+        cex = CryptoEx(asset_info, symbols=stale)
+
+        usd2krw = forex.get_fiat_fx("USD", "KRW")
+        graph = RateGraph()
+        graph.add_fiat(forex)
+        graph.add_stablecoins()
+        if known is not None and "ETH" in known:
+            graph.add("ETH", "USD", known["ETH"])
+        else:
+            graph.add("ETH", "USD", cex.get_crypto_fx("ETH", "USDT"))
 
-    usd2krw = forex.get_fiat_fx("USD", "KRW")
-    eth_price = cex.get_crypto_fx("ETH", "USDT")
+    from rich.console import Console
+    from rich.table import Table
 
     table = Table(show_footer=True, width=None, pad_edge=False, box=None, expand=True)
     table.add_column(
@@ -116,6 +260,14 @@ def main(sheet_id=None, notify=False, return_data=False):
         no_wrap=True,
         justify="left",
     )
+    extra = [c for c in currencies if c not in ("KRW", "USD", "ETH")]
+    for c in extra:
+        table.add_column(
+            f"[underline white]{c}",
+            style="rgb(50,163,219)",
+            no_wrap=True,
+            justify="left",
+        )
 
     table.add_row(
         "INVESTMENT",
@@ -124,51 +276,31 @@ def main(sheet_id=None, notify=False, return_data=False):
         "",
         "",
         "",
+        *[""] * len(extra),
         style="magenta",
     )
     table.add_row()
     # cprint(f"total investment: {format_number(asset_info['total_inv']['krw'], 4, 0)} KRW", 'cyan')
     # cprint("\nAssets:", 'magenta')
 
-    total_asset_usd = 0
-    tao_price = None
+    with METRICS.span("crypto.valuation"):
+        df = value_crypto(asset_info, cex, graph, known=known, currencies=extra)
+    tao_price = df["price"].get("TAO")
+    eth_price = graph.resolve().get("ETH", 0)
 
     rows = []
-    # for asset_class, info in asset_info["asset"].items():
-    for i, row in asset_info.iterrows():
-        symbol = row["ASSET"]
-        amount = row["AMOUNT"]
-        eth_amount = None
-        if amount == 0:
-            continue
-        if not "USD" in symbol:
-            price = cex.get_crypto_fx(symbol, "USDT")
-            if price == 0:
-                price = cex.get_crypto_fx(symbol, "WETH")
-                price = price * eth_price
-            usd_amount = amount * price
-
-            price_in_eth = (cex.get_crypto_fx(symbol, "ETH") if symbol != "ETH" else 1)
-            eth_amount = amount * price_in_eth
-            if symbol == "TAO":
-                tao_price = price
-        else:
-            price = 1
-            usd_amount = amount
-        total_asset_usd += usd_amount
-
-        # cprint(
-        #     f"- {symbol}: {format_number(amount, 3, 6)} | {format_number(usd_amount, 3, 2)} USD | {format_number(usd_amount * usd2krw, 4, 0)} KRW",
-        #     'blue')
+    for x in df.itertuples():
         rows.append([
-            symbol,
-            format_number(amount, 3, 4),
-            format_number(usd_amount * usd2krw, 4, 0),
-            format_number(usd_amount, 3, 2),
-            format_number(eth_amount, 3, 6) if eth_amount else "",
-            format_number(price, 3, 6)
+            x.Index,
+            format_number(x.amount, 3, 4),
+            format_number(x.krw, 4, 0),
+            format_number(x.usd, 3, 2),
+            format_number(x.eth, 3, 6) if x.eth > 0 else "",
+            format_number(x.price, 3, 6),
+            *[format_number(getattr(x, c.lower()), 3, 2) for c in extra],
         ])
 
+    total_asset_usd = df["usd"].sum()
     total_asset_krw = total_asset_usd * usd2krw
     total_profit_krw = total_asset_krw - total_inv_krw
     pos = total_profit_krw >= 0
@@ -177,10 +309,12 @@ def main(sheet_id=None, notify=False, return_data=False):
     rows.append([
         "TOTAL", "",
         format_number(total_asset_krw, 4, 0),
-        format_number(total_asset_usd, 3, 2), "", ""
+        format_number(total_asset_usd, 3, 2), "", "",
+        *[format_number(df[c.lower()].sum(), 3, 2) for c in extra],
     ])
     rows.append([])
-    rows.append(["PROFIT", "", plusminus + format_number(total_profit_krw, 4, 0), "", "", ""])
+    rows.append(["PROFIT", "", plusminus + format_number(total_profit_krw, 4, 0), "", "", "",
+                 *[""] * len(extra)])
 
     console = Console()
     for i, row in enumerate(rows):
@@ -209,8 +343,10 @@ def main(sheet_id=None, notify=False, return_data=False):
         #     "Current Profit",
         #     f"{plusminus + format_number(total_profit_krw, 4, 0)} | $TAO = {tao_price:.4f}")
     if return_data:
-        return rows
+        return add_totals(df, total_inv_krw, extra)
     else:
+        holdings = df.assign(symbol=df.index, **{"class": "crypto"})
+        PortfolioHistory().append(holdings, total_asset_krw, total_inv_krw, usd2krw, scope="crypto")
         console.print(table)
         cprint(f"1 USD = {usd2krw:.4f} KRW", "yellow")
 
@@ -220,4 +356,6 @@ def call_notify(title, text):
 
 
 if __name__ == "__main__":
+    import fire
+
     fire.Fire(main)
@@ -1,10 +1,65 @@
+import json
+import math
+import os
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict
 from itertools import permutations
-from uniswap import Uniswap
+
+from eth_abi import decode, encode
 from web3 import Web3
 
-PROVIDER = "https://mainnet.infura.io/v3/da307c1e384c419f85d3c8c732e4cfd6"
+from atomic_file import replace_file
+import http_client
+from quote_cache import cached_quote
+from sources import REQUEST_TIMEOUT, submit, upstream
+
+PROVIDER = os.environ.get("WEB3_PROVIDER_URI",
+                          "https://mainnet.infura.io/v3/da307c1e384c419f85d3c8c732e4cfd6")
+
+CACHE_DIR = os.environ.get("ASSET_CACHE_DIR", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# seconds a pool lookup (found or not) is trusted before the factories are asked again
+POOL_INDEX_TTL = float(os.environ.get("ASSET_POOL_INDEX_TTL", 7 * 86400))
+
+MULTICALL3 = "0xcA11bde05977b3631167028862bE2a173976CA11"
+V2_FACTORY = "0x5C69bEe701ef814a2B6a3EDD4B1652CB9cc5aA6f"
+V3_FACTORY = "0x1F98431c8aD98523631AE4a59f267346ea31F984"
+V2_ROUTER = "0x7a250d5630B4cF539739dF2C5dAcb4c659F2488D"
+V3_QUOTER = "0xb27308f9F90D607463bb33eA1BeBb41C27CE5AB6"
+WETH = "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"
+ZERO_ADDRESS = "0x" + "0" * 40
+MAX_CALLS = 200  # quotes per multicall, keeps a single eth_call under provider gas caps
+
+
+def _selector(signature):
+    return bytes(Web3.keccak(text=signature)[:4])
+
+
+AGGREGATE3 = _selector("aggregate3((address,bool,bytes)[])")
+GET_AMOUNTS_OUT = _selector("getAmountsOut(uint256,address[])")
+GET_AMOUNTS_IN = _selector("getAmountsIn(uint256,address[])")
+QUOTE_EXACT_INPUT_SINGLE = _selector(
+    "quoteExactInputSingle(address,address,uint24,uint256,uint160)")
+QUOTE_EXACT_OUTPUT_SINGLE = _selector(
+    "quoteExactOutputSingle(address,address,uint24,uint256,uint160)")
+GET_POOL = _selector("getPool(address,address,uint24)")
+GET_PAIR = _selector("getPair(address,address)")
+LIQUIDITY = _selector("liquidity()")
+GET_RESERVES = _selector("getReserves()")
+
+_web3 = None
+_lock = threading.Lock()
+
+
+def get_web3():
+    # one long-lived provider per process, on the shared keep-alive pool for its host
+    global _web3
+    with _lock:
+        if _web3 is None:
+            _web3 = Web3(Web3.HTTPProvider(PROVIDER, request_kwargs={"timeout": REQUEST_TIMEOUT},
+                                           session=http_client.CLIENT.session(PROVIDER)))
+        return _web3
 
 
 class Token:
@@ -13,110 +68,326 @@ class Token:
         self.address = Web3.to_checksum_address(address)
         self._raw_address = address
         self.symbol = symbol
-        self.decimals = decimals
+        self.decimals = int(decimals)
         self.qty = 10**self.decimals
 
+    @classmethod
+    def from_index(cls, entry):
+        # entries in the pool index are already checksummed
+        token = cls.__new__(cls)
+        token.address = token._raw_address = entry["address"]
+        token.symbol = entry["symbol"]
+        token.decimals = int(entry["decimals"])
+        token.qty = 10**token.decimals
+        return token
+
+
+def _v2_path(token_in, token_out):
+    # same default routing as uniswap-python: go through WETH unless one side already is WETH
+    if WETH in (token_in, token_out):
+        return [token_in, token_out]
+    return [token_in, WETH, token_out]
+
+
+def _quote_call(version, side, t0, t1, fee, qty):
+    # buy: how much t1 we get for qty t0. sell: how much t1 it costs to get qty t0.
+    if version == 'v2':
+        if side == 'buy':
+            path = _v2_path(t0.address, t1.address)
+            data = GET_AMOUNTS_OUT + encode(['uint256', 'address[]'], [qty, path])
+            return V2_ROUTER, data, lambda raw: decode(['uint256[]'], raw)[0][-1]
+        path = _v2_path(t1.address, t0.address)
+        data = GET_AMOUNTS_IN + encode(['uint256', 'address[]'], [qty, path])
+        return V2_ROUTER, data, lambda raw: decode(['uint256[]'], raw)[0][0]
+
+    args = ['address', 'address', 'uint24', 'uint256', 'uint160']
+    if side == 'buy':
+        data = QUOTE_EXACT_INPUT_SINGLE + encode(args, [t0.address, t1.address, fee, qty, 0])
+    else:
+        data = QUOTE_EXACT_OUTPUT_SINGLE + encode(args, [t1.address, t0.address, fee, qty, 0])
+    return V3_QUOTER, data, lambda raw: decode(['uint256'], raw)[0]
+
+
+def multicall(web3, calls):
+    # [(target, calldata)] -> [(success, returndata)] in a single eth_call per MAX_CALLS
+    results = []
+    for i in range(0, len(calls), MAX_CALLS):
+        chunk = [(target, True, data) for target, data in calls[i:i + MAX_CALLS]]
+        data = AGGREGATE3 + encode(['(address,bool,bytes)[]'], [chunk])
+        with upstream("infura"):
+            raw = web3.eth.call({'to': MULTICALL3, 'data': data})
+        results.extend(decode(['(bool,bytes)[]'], bytes(raw))[0])
+    return results
+
+
+def discover_pools(web3, pairs, fees):
+    # [(t0, t1)] -> [{"v2": liquidity, "v3": {fee: liquidity}}] from the factories, 0 where there
+    # is no pool or it is empty. liquidity is comparable across versions: v3 liquidity(), and
+    # sqrt(reserve0 * reserve1) of the thinnest hop on the v2 route
+    calls, slots = [], []
+    for i, (t0, t1) in enumerate(pairs):
+        for fee in fees:
+            calls.append((V3_FACTORY, GET_POOL + encode(['address', 'address', 'uint24'],
+                                                        [t0.address, t1.address, fee])))
+            slots.append((i, 'v3', fee))
+        path = _v2_path(t0.address, t1.address)
+        for a, b in zip(path, path[1:]):
+            calls.append((V2_FACTORY, GET_PAIR + encode(['address', 'address'], [a, b])))
+            slots.append((i, 'v2', len(path) - 1))
+
+    pools = []
+    for slot, (success, raw) in zip(slots, multicall(web3, calls)):
+        address = decode(['address'], raw)[0] if success and len(raw) >= 32 else ZERO_ADDRESS
+        if int(address, 16):
+            pools.append((slot, address))
+    states = multicall(web3, [(address, LIQUIDITY if slot[1] == 'v3' else GET_RESERVES)
+                              for slot, address in pools]) if pools else []
+
+    entries = [{'v2': 0.0, 'v3': {str(fee): 0.0 for fee in fees}} for _ in pairs]
+    hops = [[] for _ in pairs]
+    for ((i, version, key), _), (success, raw) in zip(pools, states):
+        if not success:
+            continue
+        if version == 'v3':
+            entries[i]['v3'][str(key)] = float(decode(['uint128'], raw)[0])
+        else:
+            reserve0, reserve1, _ = decode(['uint112', 'uint112', 'uint32'], raw)
+            hops[i].append(math.sqrt(reserve0 * reserve1))
+    for i, (t0, t1) in enumerate(pairs):
+        if hops[i] and len(hops[i]) == len(_v2_path(t0.address, t1.address)) - 1:
+            entries[i]['v2'] = min(hops[i])
+    return entries
+
+
+class PoolIndex:
+    # which pools exist for a pair and how deep they are, kept on disk across runs as
+    # {"pairs": {pair: {"checked": time, "v2": liquidity, "v3": {fee: liquidity}}}, "tokens": ...}.
+    # a pair is looked up once per ttl (misses too, pools do get created); token addresses are
+    # checksummed once and kept, their symbol / decimals follow the sheet
+
+    def __init__(self, path=None, ttl=POOL_INDEX_TTL) -> None:
+        self.path = path or os.path.join(CACHE_DIR, "uniswap-pools.json")
+        self.ttl = ttl
+        self.pairs = {}
+        self.tokens = {}  # lowercase address -> Token
+        self._dirty = False  # tokens added since the last save
+        self._lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.pairs = data["pairs"]
+            self.tokens = {a: Token.from_index(t) for a, t in data["tokens"].items()}
+        except (OSError, ValueError, KeyError) as e:
+            if os.path.exists(self.path):
+                print(f"ignoring unreadable pool index: {e!r}")
 
-class UniswapPrice:
-    sides = {'sell': 'get_price_output', 'buy': 'get_price_input'}
+    def _save(self):
+        tokens = {a: {"address": t.address, "symbol": t.symbol, "decimals": t.decimals}
+                  for a, t in self.tokens.items()}
+        with replace_file(self.path) as f:
+            json.dump({"pairs": self.pairs, "tokens": tokens}, f)
+        self._dirty = False
 
+    def token(self, info):
+        # dict with address/symbol/decimals -> Token, checksummed once per address. the sheet is
+        # the authority on symbol / decimals: an entry that disagrees with it is replaced, so a
+        # fixed DECIMALS typo doesn't live on in the index. call flush() to write new entries
+        key = info['address'].lower()
+        with self._lock:
+            token = self.tokens.get(key)
+            if token is not None and (token.symbol, token.decimals) == (info['symbol'], int(info['decimals'])):
+                return token
+        if token is None:
+            token = Token(info['address'], info['symbol'], info['decimals'])
+        else:
+            token = Token.from_index({"address": token.address, "symbol": info['symbol'],
+                                      "decimals": info['decimals']})
+        with self._lock:
+            self.tokens[key] = token
+            self._dirty = True
+        return token
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def _key(self, t0, t1):
+        return "-".join(sorted((t0.address.lower(), t1.address.lower())))
+
+    def live_pools(self, web3, pairs, fees):
+        # [(t0, t1)] -> [{"v2": [3000] or [], "v3": [fees with liquidity]}]. unknown or expired
+        # pairs are discovered together first; if that fails they get every pool, as before
+        now = time.time()
+        with self._lock:
+            stale = {}
+            for t0, t1 in pairs:
+                key = self._key(t0, t1)
+                if now - self.pairs.get(key, {}).get("checked", 0) >= self.ttl:
+                    stale[key] = (t0, t1)
+        if stale:
+            try:
+                found = discover_pools(web3, list(stale.values()), fees)
+            except Exception as e:
+                print(f"pool discovery failed, quoting every pool: {e!r}")
+                found = None
+            if found is not None:
+                with self._lock:
+                    for key, entry in zip(stale, found):
+                        self.pairs[key] = {"checked": now, **entry}
+                    self._save()
+
+        live = []
+        with self._lock:
+            for t0, t1 in pairs:
+                entry = self.pairs.get(self._key(t0, t1))
+                if entry is None or now - entry["checked"] >= self.ttl:
+                    live.append({'v2': [3000], 'v3': list(fees)})
+                else:
+                    live.append({'v2': [3000] if entry['v2'] > 0 else [],
+                                 'v3': [fee for fee in fees if entry['v3'].get(str(fee), 0) > 0]})
+        return live
+
+
+def quote_pairs(web3, pairs, swap, pools=None):
+    # price every (t0, t1, side) over all exchanges / fee tiers / sizes in `swap` with one
+    # multicall, or only over pools[i] = {exchange: fees} when the live pools are known.
+    # returns {exchange: {fee: {percentage: price or None}}} per pair
+    calls, slots = [], []
+    for i, (t0, t1, side) in enumerate(pairs):
+        for exchange_name, exchange_data in swap.items():
+            fees = exchange_data['fees'] if pools is None else pools[i].get(exchange_name, ())
+            for fee in fees:
+                for percentage in exchange_data['percentages']:
+                    qty = t0.qty * percentage // 100
+                    target, data, decoder = _quote_call(exchange_name, side, t0, t1, fee, qty)
+                    calls.append((target, data))
+                    slots.append((i, exchange_name, fee, percentage, decoder, t1.qty))
+
+    quotes = [defaultdict(dict) for _ in pairs]
+    results = multicall(web3, calls) if calls else []
+    for (i, exchange_name, fee, percentage, decoder, unit), (success, raw) in zip(slots, results):
+        price = None
+        if success:
+            try:
+                price = decoder(raw) / unit
+            except Exception:
+                pass
+        quotes[i][exchange_name].setdefault(fee, {})[percentage] = price
+    return [dict(q) for q in quotes]
+
+
+def pool_prices(quotes, price_type):
+    if price_type == 'single':
+        perc = 100
+    elif price_type == 'different':
+        perc = 50
+
+    return [
+        fee[perc]
+        for exchanges in quotes.values()
+        for fee in exchanges.values()
+        if isinstance(fee[perc], float)
+    ]
+
+
+def find_best(quotes, side):
+    prices = [perm[0] + perm[1] for perm in permutations(pool_prices(quotes, 'different'), 2)
+             ] + pool_prices(quotes, 'single')
+    if len(prices) == 0:
+        return
+    if side == 'sell':
+        return min(prices)
+    elif side == 'buy':
+        return max(prices)
+
+
+class PricingEngine:
+    # every call carries its own pairs and the pool index locks itself, so one engine can be
+    # shared across threads
     percentages = [50, 100]
     fees = [100, 300, 3000, 10000]
+    batch_size = 8  # pairs per multicall; batches run in parallel on the shared executor
 
-    def __init__(self, v2, v3):
+    def __init__(self, web3, executor=None, index=None):
+        self.web3 = web3
+        self.executor = executor or get_executor()
+        self.index = index or PoolIndex()
         self.swap = {
             'v2': {
-                'exchange': v2,
                 'percentages': self.percentages,
                 'fees': [3000]
             },
             'v3': {
-                'exchange': v3,
                 'percentages': self.percentages,
                 'fees': self.fees
             }
         }
 
-    def find_best(self):
-        prices = [perm[0] + perm[1] for perm in permutations(self.pool_prices('different'), 2)
-                 ] + self.pool_prices('single')
-        if len(prices) == 0:
-            return
-        if self.side == 'sell':
-            return min(prices)
-        elif self.side == 'buy':
-            return max(prices)
-
-    def get_price(self, exchange, fee, qty):
-        queue = [self.t0.address, self.t1.address
-                ] if self.side == 'buy' else [self.t1.address, self.t0.address]
-        price_func = getattr(exchange, self.sides[self.side])
-        return price_func(*queue, qty, fee=fee) / self.t1.qty
-
-    def pool_prices(self, price_type):
-        if price_type == 'single':
-            perc = 100
-        elif price_type == 'different':
-            perc = 50
-
-        return [
-            fee[perc]
-            for exchanges in self.futures.values()
-            for fee in exchanges.values()
-            if isinstance(fee[perc], float)
+    def get_best_prices(self, requests):
+        # [(token_in, token_out, side)] -> [best price or None], in request order. pairs without
+        # a live pool come back None without a quote
+        pools = self.index.live_pools(self.web3, [(t0, t1) for t0, t1, _ in requests], self.fees)
+        batches = [(requests[i:i + self.batch_size], pools[i:i + self.batch_size])
+                   for i in range(0, len(requests), self.batch_size)]
+        futures = [
+            submit(self.executor, quote_pairs, self.web3, batch, self.swap, live)
+            if any(fees for p in live for fees in p.values()) else None
+            for batch, live in batches
         ]
+        quotes = [q for future, (batch, _) in zip(futures, batches)
+                  for q in (future.result() if future is not None else [{}] * len(batch))]
+        return [find_best(q, side) for q, (_, _, side) in zip(quotes, requests)]
 
     def get_best_price(self, t0, t1, side):
-        self.t0 = t0
-        self.t1 = t1
-        self.side = side
-
-        self.get_prices()
-        return self.find_best()
-
-    def get_prices(self):
-        self.futures = defaultdict(dict)
-
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            for exchange_name, exchange_data in self.swap.items():
-                self.futures[exchange_name] = defaultdict(dict)
-                for fee in exchange_data['fees']:
-                    self.futures[exchange_name][fee] = defaultdict(dict)
-                    for percentage in exchange_data['percentages']:
-                        self.futures[exchange_name][fee][percentage] = defaultdict(dict)
-                        qty = self.t0.qty * percentage // 100
-                        self.futures[exchange_name][fee][percentage] = executor.submit(
-                            self.get_price, exchange_data['exchange'], fee, qty)
-
-            for exchange_name, exchange_fees in self.futures.items():
-                self.futures[exchange_name] = dict(exchange_fees)
-                for fee, percentage_data in exchange_fees.items():
-                    self.futures[exchange_name][fee] = dict(percentage_data)
-                    for percentage, future in percentage_data.items():
-                        try:
-                            self.futures[exchange_name][fee][percentage] = future.result()
-                        except:
-                            pass
+        return self.get_best_prices([(t0, t1, side)])[0]
 
 
-def get_price_calculator():
-    web3 = Web3(Web3.HTTPProvider(PROVIDER))
+_executor = None
+_engine = None
 
-    uni_v2 = Uniswap(address=None, private_key=None, version=2, web3=web3)
 
-    uni_v3 = Uniswap(address=None, private_key=None, version=3, web3=web3)
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=10, thread_name_prefix="uniswap")
+        return _executor
 
-    price_calculator = UniswapPrice(uni_v2, uni_v3)
 
-    def _price_calculator_api(token1, token2):
-        t1 = Token(token1['address'], token1['symbol'], token1['decimals'])
-        t2 = Token(token2['address'], token2['symbol'], token2['decimals'])
-        price = price_calculator.get_best_price(t1, t2, "sell")
+def get_engine():
+    global _engine
+    web3 = get_web3()
+    executor = get_executor()
+    with _lock:
+        if _engine is None:
+            _engine = PricingEngine(web3, executor)
+        return _engine
+
+
+def get_pair_prices(token_pairs):
+    # [(token1, token2)] dicts with address/symbol/decimals -> [price], 0 when no pool quotes
+    engine = get_engine()
+    tokens = [(engine.index.token(t1), engine.index.token(t2)) for t1, t2 in token_pairs]
+    engine.index.flush()
+    prices = engine.get_best_prices([(t1, t2, "sell") for t1, t2 in tokens])
+
+    retry = [i for i, price in enumerate(prices) if price is None]
+    if retry:
+        buy_prices = engine.get_best_prices([(*tokens[i], "buy") for i in retry])
+        for i, price in zip(retry, buy_prices):
+            prices[i] = price
+
+    for (t1, t2), price in zip(tokens, prices):
         if price is None:
-            price = price_calculator.get_best_price(t1, t2, "buy")
-            if price is None:
-                print(f"can't fetch price for this pair ({token1['symbol']}-{token2['symbol']})")
-            return 0
-        return price
+            print(f"can't fetch price for this pair ({t1.symbol}-{t2.symbol})")
+    return [0 if price is None else price for price in prices]
+
+
+def get_price_calculator():
+
+    @cached_quote("uniswap", key=lambda token1, token2: (token1['symbol'], token2['symbol']))
+    def _price_calculator_api(token1, token2):
+        return get_pair_prices([(token1, token2)])[0]
 
     return _price_calculator_api
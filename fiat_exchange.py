@@ -2,48 +2,190 @@ import os
 import datetime
 import glob
 import io
+import json
 import requests
+import threading
 import zipfile
 
-import pandas as pd
+import numpy as np
+
+from atomic_file import replace_file
+from sources import SourceUnavailable, request_timeout, upstream
+import http_client
 
 BASEPATH = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get("ASSET_CACHE_DIR", BASEPATH)
+
+_lock = threading.Lock()  # one store update at a time, however many portfolios refresh at once
+
+
+def _parse_date(s):
+    s = s.strip()
+    try:
+        return datetime.date.fromisoformat(s)
+    except ValueError:
+        return datetime.datetime.strptime(s, "%d %B %Y").date()  # daily file format
+
+
+def _parse_ecb_csv(content):
+    # ecb csv -> (dates, currencies, rates[len(dates), len(currencies)]); N/A becomes nan
+    lines = content.decode("utf-8").strip().splitlines()
+    header = [c.strip() for c in lines[0].split(",")]
+    columns = [i for i, c in enumerate(header) if c and c != "Date"]
+    currencies = [header[i] for i in columns]
+
+    dates = []
+    rates = np.full((len(lines) - 1, len(currencies)), np.nan)
+    for r, line in enumerate(lines[1:]):
+        fields = line.split(",")
+        dates.append(_parse_date(fields[0]))
+        for c, i in enumerate(columns):
+            value = fields[i].strip() if i < len(fields) else ""
+            if value and value != "N/A":
+                rates[r, c] = float(value)
+    return dates, currencies, rates
+
+
+def _read_zip(content):
+    z = zipfile.ZipFile(io.BytesIO(content))
+    return z.read(z.namelist()[0])
 
 
 class FiatEx:
+    # rates are kept as one float64 row per calendar day (non-publication days carry the
+    # previous fixing) so a date lookup is a single index into a memory-mapped array
     url = "https://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist.zip?a6ef9319d740f54c034942a0317114f8"
+    daily_url = "https://www.ecb.europa.eu/stats/eurofxref/eurofxref.zip"
+    recent_url = "https://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist-90d.zip"
+    refresh_interval = 6 * 3600
+    max_gap = 60  # days the store may lag before the full history is re-pulled; < the 90d file
 
-    def __init__(self, force_download=False) -> None:
+    def __init__(self, force_download=False, cache_dir=None) -> None:
+        cache_dir = cache_dir or CACHE_DIR
+        self.rates_path = os.path.join(cache_dir, "ecb-rates.npy")
+        self.meta_path = os.path.join(cache_dir, "ecb-rates.json")
         self.filepath = self.download(force_download=force_download)
-        self.rate = pd.read_csv(self.filepath).iloc[0]  # take most recent
+        self.load()
+
+    def load(self):
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        self.start = datetime.date.fromisoformat(meta["start"])
+        self.currencies = {c: i for i, c in enumerate(meta["currencies"])}
+        self.rates = np.load(self.rates_path, mmap_mode="r")
+        self.rate = dict(zip(meta["currencies"], self.rates[-1].tolist()))  # most recent
+
+    def _save(self, start, currencies, rates):
+        # _lock only serialises this process; other workers may be writing the store too
+        with replace_file(self.rates_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(rates, dtype=np.float64))
+        with replace_file(self.meta_path) as f:
+            json.dump({"start": start.isoformat(), "currencies": currencies}, f)
+
+    def _build(self):
+        print("ecb data may be stale. Downloading fresh data...")
+        with upstream("ecb") as request:
+            response = http_client.get(self.url, timeout=request_timeout(60))
+            if response.status_code != 200:
+                request.fail()
+        response.raise_for_status()
+        dates, currencies, rates = _parse_ecb_csv(_read_zip(response.content))
+        order = np.argsort(dates)  # history file is newest first
+        dates = [dates[i] for i in order]
+        rates = rates[order]
+
+        start = dates[0]
+        offsets = np.array([(d - start).days for d in dates])
+        published = np.zeros(offsets[-1] + 1, dtype=bool)
+        published[offsets] = True
+        # map every calendar day to the latest published fixing at or before it
+        row = np.maximum.accumulate(np.where(published, np.arange(len(published)), 0))
+        dense = np.full((len(published), len(currencies)), np.nan)
+        dense[offsets] = rates
+        dense = dense[row]
+
+        currencies = currencies + ["EUR"]
+        dense = np.hstack([dense, np.ones((len(dense), 1))])
+        self._save(start, currencies, dense)
+
+    def _fetch(self, url):
+        with upstream("ecb") as request:
+            response = http_client.get(url, timeout=request_timeout())
+            if response.status_code != 200:
+                request.fail()
+        response.raise_for_status()
+        return _parse_ecb_csv(_read_zip(response.content))
+
+    def _update(self):
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        start = datetime.date.fromisoformat(meta["start"])
+        currencies = meta["currencies"]
+        stored = np.load(self.rates_path, mmap_mode="r")
+        last = start + datetime.timedelta(days=len(stored) - 1)
+
+        dates, new_currencies, new_rates = self._fetch(self.daily_url)
+        gap = (dates[0] - last).days
+        if gap > self.max_gap:
+            return self._build()
+        if gap <= 0:
+            os.utime(self.meta_path)  # nothing new published; check again later
+            return
+        if any((last + datetime.timedelta(days=d)).weekday() < 5 for d in range(1, gap)):
+            # weekdays between the store and today's fixing may have fixings of their own
+            dates, new_currencies, new_rates = self._fetch(self.recent_url)
+
+        # the new days in store layout (EUR = 1), then every calendar day after `last` takes the
+        # latest fixing at or before it, the stored last row until the first new one
+        columns = [new_currencies.index(c) if c in new_currencies else -1 for c in currencies]
+        published = np.full((gap + 1, len(currencies)), np.nan)
+        published[0] = stored[-1]
+        for date, row in zip(dates, new_rates):
+            offset = (date - last).days
+            if 0 < offset <= gap:
+                published[offset] = [row[i] if i >= 0 else np.nan for i in columns]
+                published[offset, currencies.index("EUR")] = 1.0
+        filled = np.where(np.isnan(published).all(axis=1), 0, np.arange(gap + 1))
+        self._save(start, currencies, np.vstack([stored, published[np.maximum.accumulate(filled)][1:]]))
 
     def download(self, force_download=False):
+        with _lock:
+            return self._download(force_download)
+
+    def _download(self, force_download=False):
+        if force_download or not os.path.exists(self.rates_path) or not os.path.exists(self.meta_path):
+            self._build()
+        elif os.path.getmtime(self.meta_path) < datetime.datetime.now().timestamp() - self.refresh_interval:
+            try:
+                self._update()
+            except (requests.RequestException, SourceUnavailable) as e:
+                # a stored fixing is still a usable rate; try the ecb again on the next call
+                print(f"ecb update failed, using stored rates: {e!r}")
+
+        # delete files left by the old csv cache
+        for f in glob.glob(os.path.join(BASEPATH, "ecb-*.csv")):
+            os.remove(f)
+
+        return self.rates_path
+
+    def _row(self, date):
+        if isinstance(date, str):
+            date = datetime.date.fromisoformat(date)
+        elif isinstance(date, datetime.datetime):
+            date = date.date()
+        i = (date - self.start).days
+        if i < 0:
+            raise ValueError(f"no ecb rates before {self.start}")
+        return self.rates[min(i, len(self.rates) - 1)]
+
+    def get_fiat_fx_series(self, fiat1, fiat2, dates):
+        # get_fiat_fx for many dates at once: one fancy index into the store
+        days = (np.asarray(dates, dtype="datetime64[D]") - np.datetime64(self.start, "D")).astype(np.int64)
+        if (days < 0).any():
+            raise ValueError(f"no ecb rates before {self.start}")
+        rows = self.rates[np.minimum(days, len(self.rates) - 1)]
+        return rows[:, self.currencies[fiat2]] / rows[:, self.currencies[fiat1]]
 
-        def _download(url, fpath):
-            print("ecb data may be stale. Downloading fresh data...")
-            response = requests.get(url)
-            z = zipfile.ZipFile(io.BytesIO(response.content))
-            z.extractall()
-
-            csv_file = z.namelist()[0]
-            z.extract(csv_file)
-
-            # Rename the file to your desired filepath
-            os.rename(csv_file, fpath)
-
-        filepath = f"ecb-{datetime.datetime.today().strftime('%Y-%m-%d')}.csv"
-        filepath = os.path.join(BASEPATH, filepath)
-        if (not os.path.exists(filepath) or
-                os.path.getmtime(filepath) < datetime.datetime.now().timestamp() - 86400 or
-                force_download):
-            _download(self.url, filepath)
-            # delete stale files
-            stale_files = glob.glob(os.path.join(BASEPATH, "ecb-*.csv"))
-            for f in stale_files:
-                if f != filepath:
-                    os.remove(f)
-
-        return filepath
-
-    def get_fiat_fx(self, fiat1, fiat2):
-        return self.rate[fiat2] / self.rate[fiat1]
+    def get_fiat_fx(self, fiat1, fiat2, date=None):
+        row = self.rates[-1] if date is None else self._row(date)
+        return float(row[self.currencies[fiat2]] / row[self.currencies[fiat1]])
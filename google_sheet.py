@@ -1,6 +1,88 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 
+from atomic_file import replace_file
+from sources import request_timeout, upstream
+import http_client
+
+BASEPATH = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get("ASSET_CACHE_DIR", BASEPATH)
+SHEET_URL = "https://docs.google.com/spreadsheets/d/{}/gviz/tq?tqx=out:csv"
+
+def sheet_ids(sheet_id=None):
+    # one or many sheets: a comma separated string or a list, else ASSET_GOOGLE_SHEET_IDS or
+    # ASSET_GOOGLE_SHEET_ID from the environment
+    if sheet_id is None:
+        sheet_id = os.environ.get("ASSET_GOOGLE_SHEET_IDS") or os.environ.get("ASSET_GOOGLE_SHEET_ID")
+    if sheet_id is None:
+        raise ValueError("sheet_id is not provided")
+    if isinstance(sheet_id, str):
+        sheet_id = sheet_id.split(",")
+    ids = [str(s).strip() for s in sheet_id if str(s).strip()]
+    if not ids:
+        raise ValueError("sheet_id is not provided")
+    return ids
+
+
+def map_sheets(func, ids, return_data=False, **kwargs):
+    # run an entry point once per sheet. data runs go in parallel, so portfolios sharing symbols
+    # share their quote requests; printing runs go one after another to keep the output readable
+    if return_data:
+        with ThreadPoolExecutor(max_workers=len(ids)) as executor:
+            futures = [executor.submit(func, sheet_id=s, return_data=True, **kwargs) for s in ids]
+        return {s: f.result() for s, f in zip(ids, futures)}
+    for s in ids:
+        print(f"\n== {s}")
+        func(sheet_id=s, **kwargs)
+
+
+_parsed = {}  # sheet_id -> (sha256, frame), skips even the pickle load within a process
+_lock = threading.Lock()
+
+
+def _cache_paths(sheet_id, cache_dir):
+    base = os.path.join(cache_dir, f"sheet-{hashlib.sha1(sheet_id.encode()).hexdigest()[:16]}")
+    return base + ".pkl", base + ".json"
+
+
+def open_sheet(sheet_id, cache_dir=None):
+    # download the sheet csv, but only parse it when its content hash changed since last time
+    pkl_path, meta_path = _cache_paths(sheet_id, cache_dir or CACHE_DIR)
+    meta = {}
+    if os.path.exists(meta_path) and os.path.exists(pkl_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+    headers = {"If-None-Match": meta["etag"]} if meta.get("etag") else {}
+    with upstream("sheet") as request:
+        response = http_client.get(SHEET_URL.format(sheet_id), headers=headers,
+                                   timeout=request_timeout())
+        if response.status_code >= 400:
+            request.fail()
+    if response.status_code == 304:
+        digest = meta["sha256"]
+    else:
+        response.raise_for_status()
+        digest = hashlib.sha256(response.content).hexdigest()
 
-def open_sheet(sheet_id):
-    url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/gviz/tq?tqx=out:csv"
-    return pd.read_csv(url)
+    with _lock:
+        cached = _parsed.get(sheet_id)
+        if cached is not None and cached[0] == digest:
+            return cached[1]
+        if digest == meta.get("sha256"):
+            df = pd.read_pickle(pkl_path)
+        else:
+            df = pd.read_csv(io.BytesIO(response.content))
+            # other workers may be reading or writing the same cache
+            with replace_file(pkl_path, "wb") as f:
+                df.to_pickle(f)
+            with replace_file(meta_path) as f:
+                json.dump({"sha256": digest, "etag": response.headers.get("ETag")}, f)
+        _parsed[sheet_id] = (digest, df)
+        return df
@@ -0,0 +1,64 @@
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from sources import request_timeout
+
+# connections kept alive per host. more concurrent requests to one host open a connection that is
+# closed after use: a blocking pool would wait for a free one with no timeout, past any deadline
+POOL_SIZE = int(os.environ.get("ASSET_HTTP_POOL_SIZE", 10))
+HEADERS = {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+
+
+class HttpClient:
+    # one requests.Session per host, so every upstream keeps its own warm connections instead
+    # of paying a TCP + TLS handshake per quote. requests without a timeout get request_timeout()
+
+    def __init__(self, pool_size=POOL_SIZE) -> None:
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.headers.update(HEADERS)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=False)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host] = session
+            return session
+
+    def request(self, method, url, timeout=None, **kwargs):
+        timeout = request_timeout() if timeout is None else timeout
+        return self.session(url).request(method, url, timeout=timeout, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
+
+
+CLIENT = HttpClient()
+
+
+def get(url, **kwargs):
+    return CLIENT.get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return CLIENT.post(url, **kwargs)
+
@@ -0,0 +1,304 @@
+import json
+import math
+import os
+import threading
+import time
+
+from snapshot import build_snapshot
+from sources import REQUEST_TIMEOUT
+from valuation import SUMMARY_ROWS, VALUE_COLUMNS
+
+MEXC_WS_URL = os.environ.get("MEXC_WS_URL", "wss://wbs.mexc.com/ws")
+# mexc spot pairs streamed over the websocket; everything else is polled
+LIVE_PAIRS = [p for p in os.environ.get("ASSET_LIVE_PAIRS", "ETHUSDT").split(",") if p]
+POLL_INTERVAL = float(os.environ.get("ASSET_LIVE_POLL_INTERVAL", 30))
+IDLE_TIMEOUT = 60  # seconds without a live browser before the feed and stream stop
+PING_INTERVAL = 20  # mexc drops connections that stay quiet for a minute
+DEALS_CHANNEL = "spot@public.deals.v3.api@{}"
+QUOTES = ("USDT", "USDC")
+
+
+class PriceBoard:
+    # latest price per (class, symbol) with a version bumped on every change. _changed keeps keys
+    # in the order they last changed, so changes(since) only walks what changed after `since`
+
+    def __init__(self) -> None:
+        self.version = 0
+        self._prices = {}
+        self._changed = {}  # key -> version of its last change, oldest first
+        self._lock = threading.Lock()
+
+    def update(self, key, price):
+        with self._lock:
+            if self._prices.get(key) == price:
+                return False
+            self.version += 1
+            self._prices[key] = price
+            self._changed.pop(key, None)
+            self._changed[key] = self.version
+            return True
+
+    def get(self, key):
+        return self._prices.get(key)
+
+    def changes(self, since):
+        # ({key: price} changed after version `since`, current version)
+        with self._lock:
+            changed = {}
+            for key in reversed(self._changed):
+                if self._changed[key] <= since:
+                    break
+                changed[key] = self._prices[key]
+            return changed, self.version
+
+    def load(self, snapshot, skip=()):
+        # take every priced holding of a snapshot; keys in skip are fed by a fresher source
+        holdings = snapshot.holdings
+        for cls, symbol, price in zip(holdings["class"], holdings["symbol"], holdings["price"]):
+            if (cls, symbol) not in skip and symbol not in snapshot.missing and not math.isnan(price):
+                self.update((cls, symbol), float(price))
+
+
+class MexcStream:
+    # mexc spot trades for `pairs` pushed onto the board as ("crypto", base). runs on a daemon
+    # thread and reconnects with backoff; needs the optional `websockets` package
+    max_delay = 60
+
+    def __init__(self, board, pairs=LIVE_PAIRS, url=MEXC_WS_URL) -> None:
+        self.board = board
+        self.pairs = list(pairs)
+        self.url = url
+        self.connected = False
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def keys(self):
+        return {("crypto", self._base(p)) for p in self.pairs}
+
+    def _base(self, pair):
+        for quote in QUOTES:
+            if pair.endswith(quote):
+                return pair[:-len(quote)]
+        return pair
+
+    def start(self):
+        # False when websockets isn't installed; callers then poll everything
+        try:
+            import websockets.sync.client  # noqa: F401
+        except ImportError:
+            print("websockets is not installed, polling mexc pairs instead")
+            return False
+        if self._thread is None and self.pairs:
+            # every run gets its own stop event, so a stopped run still winding down can't keep
+            # a restarted one from running
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,), name="mexc-stream",
+                                            daemon=True)
+            self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+        self.connected = False
+
+    def _run(self, stop):
+        from websockets.sync.client import connect
+
+        delay = 1
+        while not stop.is_set():
+            try:
+                with connect(self.url, open_timeout=REQUEST_TIMEOUT) as ws:
+                    ws.send(json.dumps({
+                        "method": "SUBSCRIPTION",
+                        "params": [DEALS_CHANNEL.format(p) for p in self.pairs],
+                    }))
+                    self.connected = not stop.is_set()
+                    delay = 1
+                    while not stop.is_set():
+                        try:
+                            self.handle(ws.recv(timeout=PING_INTERVAL))
+                        except TimeoutError:
+                            ws.send(json.dumps({"method": "PING"}))
+            except Exception as e:
+                print(f"mexc stream disconnected: {e!r}")
+            if not stop.is_set():
+                self.connected = False
+            stop.wait(delay)
+            delay = min(delay * 2, self.max_delay)
+
+    def handle(self, message):
+        data = json.loads(message)
+        deals = (data.get("d") or {}).get("deals")
+        if not deals:
+            return False  # subscription acks and pongs
+        pair = data.get("s") or data.get("c", "").rsplit("@", 1)[-1]
+        latest = max(deals, key=lambda d: d.get("t", 0))
+        return self.board.update(("crypto", self._base(pair)), float(latest["p"]))
+
+
+class LiveFeed:
+    # the price board behind live mode: streamed mexc pairs plus a quote poll of every portfolio's
+    # holdings for everything else. a poll re-prices the last snapshot's sheet rows, only going
+    # upstream for quotes older than the poll interval; it doesn't replace the snapshot or record
+    # history. prices are keyed by symbol, so one board serves every portfolio.
+    # start() is called on every live tick; without one for idle_timeout seconds the feed stops
+
+    def __init__(self, refreshers, pairs=LIVE_PAIRS, poll_interval=POLL_INTERVAL, url=MEXC_WS_URL,
+                 idle_timeout=IDLE_TIMEOUT) -> None:
+        self.refreshers = list(refreshers)
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.board = PriceBoard()
+        self.stream = MexcStream(self.board, pairs, url)
+        self._thread = None
+        self._seen = 0.0  # time.monotonic() of the last start()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self._seen = time.monotonic()
+            if self._thread is None:
+                self.stream.start()
+                self._thread = threading.Thread(target=self._poll, name="live-poll", daemon=True)
+                self._thread.start()
+        return self
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def _idle(self):
+        with self._lock:
+            if time.monotonic() - self._seen < self.idle_timeout:
+                return False
+            self.stream.stop()
+            self._thread = None
+            return True
+
+    def _poll(self):
+        while not self._idle():
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"live poll failed: {e!r}")
+            time.sleep(self.poll_interval)
+
+    def poll(self):
+        skip = self.stream.keys if self.stream.connected else ()
+        for refresher in self.refreshers:
+            snapshot = refresher.latest()
+            if snapshot.age >= self.poll_interval and snapshot.assets is not None:
+                snapshot = build_snapshot(refresher.sheet_id, previous=snapshot, assets=snapshot.assets,
+                                          max_age=self.poll_interval)
+            self.board.load(snapshot, skip=skip)
+
+
+class LiveView:
+    # the holdings table as rendered: which row each holding sits in and how a new price moves
+    # its krw / usd cells and the TOTAL / PROFIT rows, so an update only produces those cells
+
+    def __init__(self, records, snapshot) -> None:
+        self.usd2krw = snapshot.usd2krw
+        self.rows = {}  # (class, symbol) -> row index
+        self.is_usd = {}  # (class, symbol) -> price is in USD (else KRW)
+        self.amount = {}
+        self.krw = {}
+        self.usd = {}
+        self.summary = {}  # (class or None, TOTAL / PROFIT) -> row index
+        self.rate = {}  # extra reporting currency column -> its units per USD
+        self.blank = set()  # (row, column) of summary cells the table leaves empty
+        self._lock = threading.Lock()
+
+        # extra currency columns move with usd at a fixed rate, read off any row that has both
+        extra = [c for c in (records[0] if records else ()) if c not in ("class", "symbol", *VALUE_COLUMNS)]
+        for r in records:
+            if _num(r.get("usd")):
+                for c in extra:
+                    if c not in self.rate and not _is_blank(r.get(c)):
+                        self.rate[c] = r[c] / r["usd"]
+
+        subtypes = {}
+        if snapshot.assets is not None:
+            stocks = snapshot.assets[snapshot.assets["CLASS"] == "stock"]
+            subtypes = dict(zip(stocks["ASSET"], stocks["SUBTYPE"]))
+        for i, r in enumerate(records):
+            cls = r.get("class") if r.get("class") in ("crypto", "stock") else None
+            symbol = r.get("symbol")
+            if symbol in SUMMARY_ROWS:
+                self.summary[(cls, symbol)] = i
+                self.blank.update((i, column) for column in ("krw", "usd", *self.rate)
+                                  if _is_blank(r.get(column)))
+            elif cls is not None and symbol is not None:
+                key = (cls, symbol)
+                self.rows[key] = i
+                self.is_usd[key] = cls == "crypto" or subtypes.get(symbol) == "us"
+                self.amount[key] = r["amount"]
+                self.krw[key] = r["krw"]
+                self.usd[key] = r["usd"]
+
+        self.total_krw = {cls: 0.0 for cls in ("crypto", "stock")}
+        self.total_usd = {cls: 0.0 for cls in ("crypto", "stock")}
+        for (cls, _), krw in self.krw.items():
+            self.total_krw[cls] += _num(krw)
+        for (cls, _), usd in self.usd.items():
+            self.total_usd[cls] += _num(usd)
+        self.investment = {
+            cls: self.total_krw[cls] - _num(records[self.summary[(cls, "PROFIT")]]["krw"])
+            for cls in ("crypto", "stock") if (cls, "PROFIT") in self.summary
+        }
+
+    def _apply(self, key, price):
+        cls = key[0]
+        local = self.amount[key] * price
+        usd = local if self.is_usd[key] else local / self.usd2krw
+        krw = local * self.usd2krw if self.is_usd[key] else local
+        self.total_krw[cls] += krw - _num(self.krw[key])
+        self.total_usd[cls] += _num(usd) - _num(self.usd[key])
+        self.krw[key], self.usd[key] = krw, usd
+
+        i = self.rows[key]
+        return {(i, "price"): price, (i, "krw"): krw, (i, "usd"): usd,
+                **{(i, c): usd * rate for c, rate in self.rate.items()}}
+
+    def _summary_cells(self, classes):
+        cells = {}
+        for cls in classes:
+            if (cls, "TOTAL") in self.summary:
+                cells[(self.summary[(cls, "TOTAL")], "krw")] = self.total_krw[cls]
+                cells[(self.summary[(cls, "TOTAL")], "usd")] = self.total_usd[cls]
+                for c, rate in self.rate.items():
+                    cells[(self.summary[(cls, "TOTAL")], c)] = self.total_usd[cls] * rate
+            if (cls, "PROFIT") in self.summary:
+                cells[(self.summary[(cls, "PROFIT")], "krw")] = self.total_krw[cls] - self.investment[cls]
+        total = sum(self.total_krw.values())
+        if (None, "TOTAL") in self.summary:
+            cells[(self.summary[(None, "TOTAL")], "krw")] = total
+            for c, rate in self.rate.items():
+                cells[(self.summary[(None, "TOTAL")], c)] = sum(self.total_usd.values()) * rate
+        if (None, "PROFIT") in self.summary:
+            cells[(self.summary[(None, "PROFIT")], "krw")] = total - sum(self.investment.values())
+        return {cell: value for cell, value in cells.items() if cell not in self.blank}
+
+    def patch(self, board, since):
+        # ({(row, column): value} for the cells board changes after `since` touch, new version)
+        changes, version = board.changes(since)
+        cells = {}
+        with self._lock:
+            classes = set()
+            for key, price in changes.items():
+                if key in self.rows:
+                    cells.update(self._apply(key, price))
+                    classes.add(key[0])
+            if classes:
+                cells.update(self._summary_cells(classes))
+        return cells, version
+
+
+def _is_blank(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _num(value):
+    return 0.0 if _is_blank(value) else value
@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from quote_cache import QUOTE_CACHE, QUOTE_FLIGHTS
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+
+    def __init__(self, buckets=BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for le, n in zip([*map(str, self.buckets), "+Inf"], self.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class _Request:
+    failed = False
+
+    def fail(self):
+        self.failed = True
+
+
+class Metrics:
+    # per-upstream request counts / errors / latency and per-stage timings, rendered in the
+    # prometheus text format. while a profile is active every observation is also recorded there
+
+    def __init__(self) -> None:
+        self.requests = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.latency = defaultdict(Histogram)
+        self.stages = defaultdict(Histogram)
+        self._profile = None
+        self._lock = threading.Lock()
+
+    def observe(self, source, seconds, error=False):
+        with self._lock:
+            self.requests[source] += 1
+            if error:
+                self.errors[source] += 1
+            self.latency[source].observe(seconds)
+            if self._profile is not None:
+                self._profile.append(("upstream", source, seconds, error))
+
+    @contextmanager
+    def track(self, source):
+        # time one upstream request; exceptions and request.fail() count as errors
+        request = _Request()
+        start = time.perf_counter()
+        try:
+            yield request
+        except BaseException:
+            request.failed = True
+            raise
+        finally:
+            self.observe(source, time.perf_counter() - start, request.failed)
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.stages[stage].observe(seconds)
+                if self._profile is not None:
+                    self._profile.append(("stage", stage, seconds, False))
+
+    @contextmanager
+    def profile(self):
+        # collect every span and upstream call (from any thread) until the block exits
+        records = []
+        with self._lock:
+            self._profile = records
+        try:
+            yield records
+        finally:
+            with self._lock:
+                self._profile = None
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines += ["# HELP asset_upstream_requests_total Requests sent to each upstream.",
+                      "# TYPE asset_upstream_requests_total counter"]
+            lines += [f'asset_upstream_requests_total{{source="{s}"}} {n}'
+                      for s, n in sorted(self.requests.items())]
+            lines += ["# HELP asset_upstream_errors_total Failed requests per upstream.",
+                      "# TYPE asset_upstream_errors_total counter"]
+            lines += [f'asset_upstream_errors_total{{source="{s}"}} {self.errors[s]}'
+                      for s in sorted(self.requests)]
+            lines += ["# HELP asset_upstream_latency_seconds Upstream request latency.",
+                      "# TYPE asset_upstream_latency_seconds histogram"]
+            for s, h in sorted(self.latency.items()):
+                lines += h.render("asset_upstream_latency_seconds", f'source="{s}"')
+            lines += ["# HELP asset_stage_seconds Time spent in each refresh stage.",
+                      "# TYPE asset_stage_seconds histogram"]
+            for s, h in sorted(self.stages.items()):
+                lines += h.render("asset_stage_seconds", f'stage="{s}"')
+
+        stats = QUOTE_CACHE.stats()
+        for kind in ("hits", "misses"):
+            lines += [f"# HELP asset_quote_cache_{kind}_total Quote cache {kind} per source.",
+                      f"# TYPE asset_quote_cache_{kind}_total counter"]
+            lines += [f'asset_quote_cache_{kind}_total{{source="{s}"}} {v[kind]}'
+                      for s, v in stats.items()]
+        lines += ["# HELP asset_quote_coalesced_total Quote requests served by an identical in-flight call.",
+                  "# TYPE asset_quote_coalesced_total counter"]
+        lines += [f'asset_quote_coalesced_total{{source="{s}"}} {n}'
+                  for s, n in sorted(QUOTE_FLIGHTS.merged.items())]
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+def format_profile(records):
+    stages = [(name, seconds) for kind, name, seconds, _ in records if kind == "stage"]
+    upstreams = defaultdict(lambda: [0, 0.0, 0])
+    for kind, name, seconds, error in records:
+        if kind == "upstream":
+            upstreams[name][0] += 1
+            upstreams[name][1] += seconds
+            upstreams[name][2] += error
+
+    lines = ["stage                      seconds"]
+    lines += [f"{name:<24} {seconds:9.3f}" for name, seconds in stages]
+    lines.append("upstream       calls  errors  total seconds")
+    lines += [f"{name:<14} {n:5d}  {errors:6d}  {seconds:13.3f}"
+              for name, (n, seconds, errors) in sorted(upstreams.items())]
+    return "\n".join(lines)
@@ -0,0 +1,120 @@
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+BASEPATH = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get("ASSET_CACHE_DIR", BASEPATH)
+HISTORY_DB = os.environ.get("ASSET_HISTORY_DB", os.path.join(CACHE_DIR, "portfolio-history.sqlite"))
+
+HOLDING_COLUMNS = ["symbol", "class", "amount", "price", "krw", "usd"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS holdings (
+    ts REAL NOT NULL,
+    scope TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    class TEXT,
+    amount REAL,
+    price REAL,
+    krw REAL,
+    usd REAL
+);
+CREATE INDEX IF NOT EXISTS holdings_ts ON holdings (ts);
+CREATE INDEX IF NOT EXISTS holdings_symbol_ts ON holdings (symbol, ts);
+CREATE TABLE IF NOT EXISTS portfolio (
+    ts REAL NOT NULL,
+    scope TEXT NOT NULL,
+    total_krw REAL,
+    investment_krw REAL,
+    profit_krw REAL,
+    usd2krw REAL
+);
+CREATE INDEX IF NOT EXISTS portfolio_scope_ts ON portfolio (scope, ts);
+"""
+
+
+def _ts(t):
+    if t is None or isinstance(t, (int, float)):
+        return t
+    return pd.Timestamp(t).timestamp()
+
+
+def _range(start, end):
+    clause, params = "", []
+    if start is not None:
+        clause += " AND ts >= ?"
+        params.append(_ts(start))
+    if end is not None:
+        clause += " AND ts <= ?"
+        params.append(_ts(end))
+    return clause, params
+
+
+class PortfolioHistory:
+    # append-only store of every computed snapshot. scope tells full-portfolio snapshots ("all")
+    # apart from the crypto-only / stock-only CLI runs
+
+    def __init__(self, path=None) -> None:
+        self.path = path or HISTORY_DB
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def append(self, holdings, total_krw, investment_krw, usd2krw, scope="all", ts=None):
+        ts = time.time() if ts is None else _ts(ts)
+        holdings = holdings.reindex(columns=HOLDING_COLUMNS)
+        numeric = holdings[["amount", "price", "krw", "usd"]].apply(pd.to_numeric, errors="coerce")
+        numeric = numeric.astype(object).where(numeric.notna(), None)
+        rows = zip(holdings["symbol"], holdings["class"], *(numeric[c] for c in numeric.columns))
+        with self._connect() as conn:
+            conn.executemany("INSERT INTO holdings VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             [(ts, scope, *row) for row in rows])
+            conn.execute("INSERT INTO portfolio VALUES (?, ?, ?, ?, ?, ?)",
+                         (ts, scope, float(total_krw), float(investment_krw),
+                          float(total_krw) - float(investment_krw), float(usd2krw)))
+        return ts
+
+    def _query(self, sql, params):
+        with self._connect() as conn:
+            df = pd.read_sql_query(sql, conn, params=params)
+        df["ts"] = pd.to_datetime(df["ts"], unit="s")
+        return df
+
+    def holdings(self, symbol=None, start=None, end=None, scope=None):
+        clause, params = _range(start, end)
+        if symbol is not None:
+            clause += " AND symbol = ?"
+            params.append(symbol)
+        if scope is not None:
+            clause += " AND scope = ?"
+            params.append(scope)
+        return self._query(f"SELECT * FROM holdings WHERE 1 = 1{clause} ORDER BY ts", params)
+
+    def value_over_time(self, scope="all", start=None, end=None):
+        clause, params = _range(start, end)
+        df = self._query(
+            f"SELECT ts, total_krw, investment_krw, profit_krw, usd2krw FROM portfolio"
+            f" WHERE scope = ?{clause} ORDER BY ts", [scope] + params)
+        return df.set_index("ts")
+
+    def asset_pnl(self, scope="all", start=None, end=None):
+        # per-asset KRW pnl from price moves only: previous amount x change in unit value,
+        # so buys and sells between snapshots don't show up as profit
+        df = self.holdings(start=start, end=end, scope=scope)
+        df = df.drop_duplicates(["ts", "symbol"], keep="last")
+        amount = df.pivot(index="ts", columns="symbol", values="amount")
+        krw = df.pivot(index="ts", columns="symbol", values="krw")
+        unit_krw = krw / amount.replace(0, np.nan)
+        return (amount.shift() * unit_krw.diff()).fillna(0).cumsum()
+
+    def drawdown(self, scope="all", start=None, end=None):
+        df = self.value_over_time(scope=scope, start=start, end=end)
+        total = df["total_krw"]
+        peak = total.cummax()
+        return pd.DataFrame({"total_krw": total, "peak_krw": peak, "drawdown": total / peak - 1})
@@ -0,0 +1,164 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future
+from functools import wraps
+
+DEFAULT_TTL = 30
+# seconds a quote stays fresh, per upstream
+SOURCE_TTL = {
+    "mexc": 10,
+    "dexscreener": 30,
+    "uniswap": 60,
+    "naver": 60,
+    "us_equity": 60,
+}
+
+_MISSING = object()
+
+
+class QuoteCache:
+
+    def __init__(self, maxsize=1024, ttl=None, default_ttl=DEFAULT_TTL) -> None:
+        self.maxsize = maxsize
+        self.ttl = dict(SOURCE_TTL if ttl is None else ttl)
+        self.default_ttl = default_ttl
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, source, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get((source, key), _MISSING)
+            if entry is not _MISSING and entry[0] > now:
+                self._data.move_to_end((source, key))
+                self.hits[source] += 1
+                return entry[1]
+            if entry is not _MISSING:
+                del self._data[(source, key)]
+            self.misses[source] += 1
+            return default
+
+    def set(self, source, key, value):
+        expires = time.monotonic() + self.ttl.get(source, self.default_ttl)
+        with self._lock:
+            self._data[(source, key)] = (expires, value)
+            self._data.move_to_end((source, key))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self, source=None):
+        with self._lock:
+            if source is None:
+                self._data.clear()
+            else:
+                for k in [k for k in self._data if k[0] == source]:
+                    del self._data[k]
+
+    def stats(self):
+        with self._lock:
+            sources = set(self.hits) | set(self.misses)
+            return {s: {"hits": self.hits[s], "misses": self.misses[s]} for s in sorted(sources)}
+
+    def __len__(self):
+        return len(self._data)
+
+
+QUOTE_CACHE = QuoteCache()
+
+
+class SingleFlight:
+    # merges concurrent identical requests: the first caller for a key fetches, everyone asking
+    # for the same key meanwhile waits for that result instead of going upstream again
+
+    def __init__(self) -> None:
+        self.merged = defaultdict(int)  # requests served by someone else's call, per source
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, source, key, func):
+        key = (source, key)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+            else:
+                self.merged[source] += 1
+        if not leader:
+            return call.result()
+        try:
+            value = func()
+            call.set_result(value)
+            return value
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def do_many(self, source, keys, func):
+        # bulk form: func(keys nobody is fetching yet) -> {key: value}. returns values for every
+        # key that got one, including those fetched by other callers
+        keys = list(dict.fromkeys(keys))
+        with self._lock:
+            theirs = {k: self._calls[(source, k)] for k in keys if (source, k) in self._calls}
+            calls = {k: Future() for k in keys if k not in theirs}
+            for k, call in calls.items():
+                self._calls[(source, k)] = call
+            self.merged[source] += len(theirs)
+        try:
+            values = func(list(calls)) if calls else {}
+            for k, call in calls.items():
+                call.set_result(values.get(k))
+        except BaseException as e:
+            for call in calls.values():
+                call.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                for k in calls:
+                    del self._calls[(source, k)]
+
+        values = dict(values)
+        for k, call in theirs.items():
+            try:
+                value = call.result()
+            except Exception:
+                continue
+            if value is not None:
+                values[k] = value
+        return values
+
+
+QUOTE_FLIGHTS = SingleFlight()
+
+
+def cached_quote(source, key=None, cache=None):
+    # memoize a price function under (source, key); None results and exceptions are not cached
+
+    def decorator(func):
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            store = cache or QUOTE_CACHE
+            k = key(*args, **kwargs) if key is not None else (args, tuple(sorted(kwargs.items())))
+            value = store.get(source, k, _MISSING)
+            if value is not _MISSING:
+                return value
+
+            def load():
+                value = func(*args, **kwargs)
+                if value is not None:
+                    store.set(source, k, value)
+                return value
+
+            # concurrent misses for the same quote (e.g. several portfolios) share one call
+            return QUOTE_FLIGHTS.do(source, k, load)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,78 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+STABLECOINS = ("USDT", "USDC", "DAI")
+PRICED_IN = ("USD", "ETH", *STABLECOINS)
+PIVOT = "USD"  # every node is priced in this first; cross rates are ratios of those prices
+
+
+class RateGraph:
+    # every quote we have (ecb fixings, mexc, dexscreener, uniswap, stock closes) as an edge
+    # "1 base = rate quote", usable both ways. resolve() prices every node in PIVOT one hop level
+    # at a time, all nodes of a level in one numpy step, preferring edges added earlier. any
+    # currency connected to the graph can then be reported without another request
+
+    def __init__(self) -> None:
+        self.edges = []  # (base, quote, rate), most trusted first
+
+    def add(self, base, quote, rate):
+        if rate is not None and math.isfinite(rate) and rate > 0 and base != quote:
+            self.edges.append((base, quote, float(rate)))
+
+    def has_price(self, node):
+        # node has a quote of its own against USD, a stablecoin or ETH; showing up as the quote
+        # side of another token's pair doesn't count
+        return any(base == node and quote in PRICED_IN for base, quote, _ in self.edges)
+
+    def add_fiat(self, forex):
+        # ecb fixings are quoted per EUR
+        for currency, rate in forex.rate.items():
+            self.add("EUR", currency, rate)
+
+    def add_stablecoins(self, coins=STABLECOINS):
+        for coin in coins:
+            self.add(coin, "USD", 1.0)
+        self.add("WETH", "ETH", 1.0)
+
+    def add_dex(self, symbol, prices):
+        # dexscreener {quote symbol: {"native": price in quote, "usd": price in USD}}
+        if not prices:
+            return
+        self.add(symbol, "USD", max(p["usd"] for p in prices.values()))
+        for quote, p in prices.items():
+            self.add(symbol, quote, p["native"])
+
+    def resolve(self, pivot=PIVOT):
+        # price of one unit of every node in pivot; NaN for nodes not connected to it
+        if not self.edges:
+            return pd.Series([1.0], index=[pivot])
+        base, quote, rate = zip(*self.edges)
+        nodes = pd.Index(list(dict.fromkeys((*base, *quote, pivot))))
+        b, q = nodes.get_indexer(base), nodes.get_indexer(quote)
+        w = np.log(np.asarray(rate))
+        # node src can be priced from node via: log p[src] = log p[via] + weight
+        src, via = np.concatenate([b, q]), np.concatenate([q, b])
+        weight = np.concatenate([w, -w])
+        order = np.tile(np.arange(len(w)), 2)
+
+        value = np.full(len(nodes), np.nan)
+        value[nodes.get_loc(pivot)] = 0.0
+        for _ in range(len(nodes)):
+            ready = ~np.isnan(value[via]) & np.isnan(value[src])
+            if not ready.any():
+                break
+            s, v, wt, o = src[ready], via[ready], weight[ready], order[ready]
+            first = np.lexsort((o, s))  # per node, its most trusted usable edge first
+            s, v, wt = s[first], v[first], wt[first]
+            _, take = np.unique(s, return_index=True)
+            value[s[take]] = value[v[take]] + wt[take]
+        return pd.Series(np.exp(value), index=nodes)
+
+    def rates(self, currencies, pivot=PIVOT):
+        # [node, currency] -> value of one unit of node in currency
+        prices = self.resolve(pivot)
+        per_unit = prices.reindex(list(currencies)).to_numpy()
+        return pd.DataFrame(prices.to_numpy()[:, None] / per_unit[None, :], index=prices.index,
+                            columns=list(currencies))
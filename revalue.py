@@ -0,0 +1,145 @@
+import datetime
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "stock_utils"))
+from crypto_utils.my_crypto import get_mexc_daily_closes
+from stock_utils.stock_prices import get_kr_ohlcv
+from us_quotes import get_us_history  # same module stock_prices imports, not a second copy
+from fiat_exchange import FiatEx
+from google_sheet import open_sheet, sheet_ids
+
+# Value today's holdings over a date range from daily history (Naver OHLCV, yahoo chart, mexc
+# klines, ECB fixings): one history request per asset instead of one refresh per day.
+#
+#   python revalue.py --days 365 --output history.json
+#   python revalue.py --sheet_id a,b,c --start 2024-01-01 --output history.parquet
+
+MAX_WORKERS = 8  # concurrent history downloads per sheet
+SUMMARY_COLUMNS = ["crypto_krw", "stock_krw", "total_krw", "investment_krw", "profit_krw", "usd2krw",
+                   "missing"]
+
+
+def _dates(start=None, end=None, days=365):
+    end = pd.Timestamp(end or datetime.date.today()).normalize()
+    start = pd.Timestamp(start).normalize() if start else end - pd.Timedelta(days=days - 1)
+    return pd.date_range(start, end, freq="D", name="Date")
+
+
+def _holdings(assets):
+    # the priced rows of a sheet as class / symbol / kind / key / amount. kind picks the history
+    # source: kr (naver, KRW), us (yahoo, USD), usd (stablecoin, 1 USD) or crypto (mexc, USD)
+    crypto = assets[(assets["CLASS"] == "crypto") & (assets["SUBTYPE"] == "dex") & (assets["AMOUNT"] != 0)]
+    stock = assets[(assets["CLASS"] == "stock") & assets["SUBTYPE"].isin(["kr", "us"])]
+    is_stable = crypto["ASSET"].str.contains("USD").to_numpy()
+    return pd.DataFrame({
+        "class": ["crypto"] * len(crypto) + ["stock"] * len(stock),
+        "symbol": [*crypto["ASSET"], *stock["ASSET"]],
+        "kind": [*np.where(is_stable, "usd", "crypto"), *stock["SUBTYPE"]],
+        "key": [*crypto["ASSET"].replace("WETH", "ETH"),
+                *np.where(stock["SUBTYPE"] == "us", stock["ASSET"],
+                          stock["TICKER"].astype(str).str.replace("\"", ""))],
+        "amount": np.concatenate([crypto["AMOUNT"].to_numpy(dtype="float64"),
+                                  stock["AMOUNT"].to_numpy(dtype="float64")]),
+    })
+
+
+def _history(kind, key, dates):
+    if kind == "kr":
+        # naver counts trading days; the calendar span always covers them
+        lookback = (pd.Timestamp(datetime.date.today()) - dates[0]).days + 1
+        return get_kr_ohlcv(key, lookback)["Close"]
+    if kind == "us":
+        return get_us_history(key, dates[0], dates[-1])
+    if kind == "usd":
+        return pd.Series(1.0, index=dates)
+    return get_mexc_daily_closes(key + "USDT", dates[0], dates[-1])
+
+
+def price_history(holdings, dates, max_workers=MAX_WORKERS):
+    # [len(dates), len(holdings)] closes in each asset's own currency, carried forward over
+    # days without a close; NaN before the first close or when the asset has no history
+
+    def fetch(row):
+        try:
+            closes = _history(row.kind, row.key, dates)
+        except Exception as e:
+            print(f"no history for {row.symbol}: {e!r}")
+            return np.full(len(dates), np.nan)
+        return closes.reindex(closes.index.union(dates)).ffill().reindex(dates).to_numpy()
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        columns = list(executor.map(fetch, holdings.itertuples()))
+    return np.column_stack(columns) if columns else np.empty((len(dates), 0))
+
+
+def revalue(assets, dates, forex=None, max_workers=MAX_WORKERS):
+    # one row per date: KRW value of every holding at its close that day, plus the totals. a
+    # total is NaN on dates where a held asset has no price; "missing" lists those assets
+    forex = forex or FiatEx()
+    holdings = _holdings(assets)
+    prices = price_history(holdings, dates, max_workers)
+    usd2krw = forex.get_fiat_fx_series("USD", "KRW", dates)
+
+    local = prices * holdings["amount"].to_numpy()
+    is_usd = (holdings["kind"] != "kr").to_numpy()
+    krw = np.where(is_usd, local * usd2krw[:, None], local)
+    unpriced = np.isnan(krw) & (holdings["amount"] != 0).to_numpy()
+    krw[np.isnan(krw) & ~unpriced] = 0.0  # no price but nothing held
+    is_crypto = (holdings["class"] == "crypto").to_numpy()
+    investment = float(assets[assets["SUBTYPE"] == "inv"]["AMOUNT"].sum())
+
+    df = pd.DataFrame(krw, index=dates, columns=holdings["symbol"].to_numpy())
+    df["crypto_krw"] = krw[:, is_crypto].sum(axis=1)
+    df["stock_krw"] = krw[:, ~is_crypto].sum(axis=1)
+    df["total_krw"] = df["crypto_krw"] + df["stock_krw"]
+    df["investment_krw"] = investment
+    df["profit_krw"] = df["total_krw"] - investment
+    df["usd2krw"] = usd2krw
+    symbols = holdings["symbol"].to_numpy()
+    df["missing"] = [", ".join(symbols[row]) for row in unpriced]
+    df.attrs["missing"] = list(symbols[unpriced.all(axis=0)])  # held, no price on any date
+    return df
+
+
+def revalue_sheet(sheet_id, start=None, end=None, days=365):
+    return revalue(open_sheet(sheet_id), _dates(start, end, days))
+
+
+def main(sheet_id=None, start=None, end=None, days=365, output=None, workers=None):
+    ids = sheet_ids(sheet_id)
+    FiatEx()  # build / update the ecb store once, before any worker reads it
+
+    if len(ids) == 1:
+        frames = {ids[0]: revalue_sheet(ids[0], start, end, days)}
+    else:
+        # one process per sheet: downloads overlap and the numpy work runs on every core
+        with ProcessPoolExecutor(max_workers=workers or min(len(ids), os.cpu_count())) as executor:
+            futures = {s: executor.submit(revalue_sheet, s, start, end, days) for s in ids}
+        frames = {s: f.result() for s, f in futures.items()}
+
+    for s, df in frames.items():
+        if df.attrs.get("missing"):
+            print(f"{s}: no price history for {', '.join(df.attrs['missing'])}")
+        incomplete = int((df["missing"] != "").sum())
+        if incomplete:
+            print(f"{s}: no totals on {incomplete} dates with unpriced holdings (see the missing column)")
+    df = frames[ids[0]] if len(ids) == 1 else pd.concat(frames, names=["sheet"])
+
+    if output is None:
+        pd.options.display.float_format = '{:,.2f}'.format
+        print(df[SUMMARY_COLUMNS].to_string())
+    elif output.endswith(".parquet"):
+        df.to_parquet(output)
+    else:
+        df.reset_index().to_json(output, orient="records", date_format="iso")
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(main)
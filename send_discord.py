@@ -1,9 +1,128 @@
+import atexit
 import os
+import queue
+import threading
+import time
+
 import requests
 
+import http_client
+from metrics import METRICS
+from sources import REQUEST_TIMEOUT
+
 discord_webhook = os.environ.get('DISCORD_WEBHOOK_URL')
 
+QUEUE_SIZE = 100
+COALESCE_WINDOW = float(os.environ.get("DISCORD_COALESCE_WINDOW", 30))  # seconds an identical message is suppressed
+MIN_INTERVAL = 1.0  # seconds between posts; whatever queued up meanwhile goes out as one message
+MAX_LENGTH = 2000  # discord content limit
+MAX_RETRIES = 4
+BACKOFF = 1.0
+
+
+class Notifier:
+    # callers only pay for an enqueue. a daemon thread drains the queue, joins everything pending
+    # into as few posts as the length limit allows and retries failed posts with backoff
+
+    def __init__(self, webhook=None, window=COALESCE_WINDOW, maxsize=QUEUE_SIZE) -> None:
+        self.webhook = webhook
+        self.window = window
+        self.queue = queue.Queue(maxsize)
+        self._recent = {}  # message -> time.monotonic() it was last accepted
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def send(self, message):
+        # False when the message was suppressed as a duplicate or the queue is full
+        now = time.monotonic()
+        with self._lock:
+            self._recent = {m: t for m, t in self._recent.items() if now - t < self.window}
+            if message in self._recent:
+                return False
+            self._recent[message] = now
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="discord-notifier", daemon=True)
+                self._thread.start()
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            print("discord queue full, dropping message")
+            with self._lock:
+                if self._recent.get(message) == now:
+                    del self._recent[message]  # never sent, so a retry isn't a duplicate
+            return False
+        return True
+
+    def _drain(self):
+        messages = [self.queue.get()]
+        while True:
+            try:
+                messages.append(self.queue.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def _batches(self, messages):
+        batch = ""
+        for message in messages:
+            if batch and len(batch) + 2 + len(message) > MAX_LENGTH:
+                yield batch
+                batch = ""
+            batch = f"{batch}\n\n{message}" if batch else message[:MAX_LENGTH]
+        if batch:
+            yield batch
+
+    def _run(self):
+        while True:
+            messages = self._drain()
+            try:
+                for content in self._batches(messages):
+                    self._post(content)
+            except Exception as e:
+                print(f"discord notification failed: {e!r}")
+            finally:
+                for _ in messages:
+                    self.queue.task_done()
+            time.sleep(MIN_INTERVAL)
+
+    def _post(self, content):
+        webhook = self.webhook or discord_webhook
+        if webhook is None:
+            print("DISCORD_WEBHOOK_URL is not set, dropping message")
+            return
+        for attempt in range(MAX_RETRIES + 1):
+            delay = BACKOFF * 2**attempt
+            try:
+                with METRICS.track("discord") as request:
+                    response = http_client.post(webhook, json={'content': content},
+                                                timeout=REQUEST_TIMEOUT)
+                    if response.status_code >= 400:
+                        request.fail()
+                if response.status_code < 400:
+                    return
+                if response.status_code == 429:
+                    delay = float(response.headers.get("Retry-After", delay))
+                elif response.status_code < 500:
+                    # a bad request won't get better by retrying; drop just this batch
+                    print(f"discord rejected the message: {response.status_code} {response.text[:200]}")
+                    return
+            except requests.ConnectionError as e:
+                print(f"discord post failed: {e!r}")
+            except requests.Timeout as e:
+                print(f"discord post timed out: {e!r}")
+            if attempt < MAX_RETRIES:
+                time.sleep(delay)
+        print("giving up on discord notification")
+
+    def flush(self, timeout=10):
+        # wait (bounded) for queued messages to go out; used at exit so CLI runs don't lose them
+        end = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < end:
+            time.sleep(0.05)
+
+
+NOTIFIER = Notifier()
+atexit.register(NOTIFIER.flush)
+
 
 def send_discord_message(message):
-    payload = {'content': message}
-    requests.post(discord_webhook, json=payload)
+    return NOTIFIER.send(message)
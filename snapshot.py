@@ -0,0 +1,185 @@
+import hashlib
+import os
+import threading
+import time
+
+import pandas as pd
+
+from crypto_utils.my_crypto import main as mycrypto
+from stock_utils.stock_prices import main as mystock
+from quote_cache import QUOTE_CACHE
+from fiat_exchange import FiatEx
+from google_sheet import open_sheet
+from valuation import SUMMARY_ROWS
+from metrics import METRICS, format_profile
+from sources import REFRESH_DEADLINE, deadline
+
+REFRESH_INTERVAL = float(os.environ.get("ASSET_REFRESH_INTERVAL", 300))
+PROFILE = bool(os.environ.get("ASSET_PROFILE"))  # print a stage breakdown after every refresh
+# seconds a price is carried over. by default a price fetched in one scheduled refresh is reused
+# by the next one (interval plus the time a refresh may take) and re-fetched in the one after
+PRICE_MAX_AGE = float(os.environ.get("ASSET_PRICE_MAX_AGE", REFRESH_INTERVAL + REFRESH_DEADLINE))
+
+
+def _pricing_rows(assets):
+    # everything in a sheet row that decides how an asset is priced, keyed by (CLASS, ASSET)
+    rows = assets.drop(columns="AMOUNT").set_index(["CLASS", "ASSET"])
+    return rows[~rows.index.duplicated(keep=False)]
+
+
+class Snapshot:
+
+    def __init__(self, crypto_df, stock_df, usd2krw, degraded=(), assets=None, priced_at=None) -> None:
+        self.crypto_df = crypto_df
+        self.stock_df = stock_df
+        self.usd2krw = usd2krw
+        self.created_at = time.time()
+        self.assets = assets  # the sheet rows this snapshot was built from
+        self.priced_at = priced_at or {}  # (class, symbol) -> when its price was fetched
+        # holdings no source could price (valued at 0) and upstreams that failed or were skipped
+        self.missing = crypto_df.attrs.get("missing", []) + stock_df.attrs.get("missing", [])
+        self.degraded = sorted(degraded)
+        self._digest = None
+
+        self.total_stake = float(crypto_df.loc["TOTAL", "krw"] + stock_df.loc["TOTAL", "krw"])
+        self.crypto_profit = float(crypto_df.loc["PROFIT", "krw"])
+        self.stock_profit = float(stock_df.loc["PROFIT", "krw"])
+        self.total_profit = self.crypto_profit + self.stock_profit
+
+    def known_prices(self, assets, max_age=PRICE_MAX_AGE):
+        # prices a snapshot of `assets` can reuse: the asset's sheet row differs at most in
+        # AMOUNT, it was priced and the price is younger than max_age.
+        # returns ({symbol: usd price}, {asset: price}) for the two pipelines
+        crypto_known, stock_known = {}, {}
+        if self.assets is None:
+            return crypto_known, stock_known
+        prev, new = _pricing_rows(self.assets), _pricing_rows(assets)
+        if list(prev.columns) != list(new.columns):
+            return crypto_known, stock_known
+        common = prev.index.intersection(new.index)
+        a, b = prev.loc[common], new.loc[common]
+        unchanged = common[((a == b) | (a.isna() & b.isna())).all(axis=1).to_numpy()]
+
+        now = time.time()
+        for cls, symbol in unchanged:
+            df = self.crypto_df if cls == "crypto" else self.stock_df
+            if (symbol not in df.index or symbol in self.missing
+                    or now - self.priced_at.get((cls, symbol), 0) >= max_age):
+                continue
+            known = crypto_known if cls == "crypto" else stock_known
+            known[symbol] = float(df.loc[symbol, "price"])
+        return crypto_known, stock_known
+
+    @property
+    def partial(self):
+        return bool(self.missing)
+
+    @property
+    def digest(self):
+        # content hash of what the view shows; rebuilds that came out the same share it
+        if self._digest is None:
+            h = hashlib.blake2b(digest_size=16)
+            for df in (self.crypto_df, self.stock_df):
+                h.update(pd.util.hash_pandas_object(df).to_numpy().tobytes())
+            h.update(repr((self.usd2krw, self.missing, self.degraded)).encode())
+            self._digest = h.hexdigest()
+        return self._digest
+
+    @property
+    def age(self):
+        return time.time() - self.created_at
+
+    @property
+    def holdings(self):
+        df = pd.concat([self.crypto_df, self.stock_df])
+        return df[~df["symbol"].isin(SUMMARY_ROWS)]
+
+
+def build_snapshot(sheet_id, seconds=REFRESH_DEADLINE, previous=None, assets=None, max_age=PRICE_MAX_AGE):
+    # one sheet load per refresh, shared by both pipelines. upstream calls are cut off after
+    # `seconds`, whatever was priced by then makes it into the (partial) snapshot.
+    # with a previous snapshot only new, changed, unpriced or stale (older than max_age) assets
+    # go upstream. given `assets`, the sheet isn't downloaded again
+    started = time.time()
+    with deadline(seconds) as degraded:
+        if assets is None:
+            with METRICS.span("refresh.sheet"):
+                assets = open_sheet(sheet_id)
+        crypto_known, stock_known = ((None, None) if previous is None
+                                     else previous.known_prices(assets, max_age))
+        with METRICS.span("refresh.crypto"):
+            crypto_df = mycrypto(notify=False, return_data=True, assets=assets, known=crypto_known)
+        with METRICS.span("refresh.stock"):
+            stock_df = mystock(return_data=True, assets=assets, known=stock_known)
+        usd2krw = FiatEx().get_fiat_fx("USD", "KRW")
+
+    priced_at = {}
+    for cls, df, known in (("crypto", crypto_df, crypto_known), ("stock", stock_df, stock_known)):
+        for symbol in df.index.difference(SUMMARY_ROWS):
+            priced_at[(cls, symbol)] = (previous.priced_at[(cls, symbol)]
+                                        if known and symbol in known else started)
+
+    crypto_df["class"] = "crypto"
+    stock_df["class"] = "stock"
+    return Snapshot(crypto_df, stock_df, usd2krw, degraded, assets, priced_at)
+
+
+class SnapshotRefresher:
+    # rebuilds the portfolio snapshot on a background thread; readers always get the last
+    # complete snapshot, which is swapped in with a single reference assignment
+
+    def __init__(self, sheet_id, interval=REFRESH_INTERVAL, history=None, scope="all") -> None:
+        self.sheet_id = sheet_id
+        self.interval = interval
+        self.history = history
+        self.scope = scope  # history scope, one per portfolio when several are served
+        self._snapshot = None
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="snapshot-refresher", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"snapshot refresh failed: {e!r}")
+            time.sleep(self.interval)
+
+    def refresh(self, force=False, profile=PROFILE):
+        # concurrent callers share one in-flight refresh instead of stacking more
+        started = time.time()
+        with self._refresh_lock:
+            if self._snapshot is not None and self._snapshot.created_at >= started:
+                return self._snapshot
+            previous = self._snapshot
+            if force:
+                QUOTE_CACHE.clear()
+                previous = None
+            if profile:
+                with METRICS.profile() as records, METRICS.span("refresh"):
+                    snapshot = build_snapshot(self.sheet_id, previous=previous)
+                print(format_profile(records))
+            else:
+                with METRICS.span("refresh"):
+                    snapshot = build_snapshot(self.sheet_id, previous=previous)
+            self._snapshot = snapshot
+        if self.history is not None:
+            try:
+                self.history.append(snapshot.holdings, snapshot.total_stake,
+                                    snapshot.total_stake - snapshot.total_profit, snapshot.usd2krw,
+                                    scope=self.scope, ts=snapshot.created_at)
+            except Exception as e:
+                print(f"failed to record snapshot: {e!r}")
+        return snapshot
+
+    def latest(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.refresh()
+        return snapshot
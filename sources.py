@@ -0,0 +1,193 @@
+import contextvars
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import wraps
+
+import requests
+
+from metrics import METRICS
+
+REQUEST_TIMEOUT = float(os.environ.get("ASSET_REQUEST_TIMEOUT", 10))
+REFRESH_DEADLINE = float(os.environ.get("ASSET_REFRESH_DEADLINE", 60))
+HEDGE_DELAY = float(os.environ.get("ASSET_HEDGE_DELAY", 1.0))  # seconds before the fallback races
+
+
+class SourceUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # open after `threshold` consecutive failures; after `cooldown` seconds one trial request is
+    # let through (half open) and its outcome closes or re-opens the breaker
+    threshold = 3
+    cooldown = 60
+
+    def __init__(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record(self, ok):
+        with self._lock:
+            self._trial = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+BREAKERS = defaultdict(CircuitBreaker)
+
+# (time.monotonic() by which the current refresh has to be done, sources skipped or failed
+# during it). a context variable so concurrent refreshes of different portfolios don't mix;
+# submit() carries it over to worker threads
+_deadline = contextvars.ContextVar("deadline", default=None)
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="sources")
+
+
+@contextmanager
+def deadline(seconds=REFRESH_DEADLINE):
+    # bound everything inside the block: request timeouts shrink to the time left and once it
+    # is spent upstream calls fail fast. yields the set of sources that came up short
+    partial = set()
+    token = _deadline.set((time.monotonic() + seconds, partial))
+    try:
+        yield partial
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    current = _deadline.get()
+    return None if current is None else current[0] - time.monotonic()
+
+
+def submit(executor, func, *args, **kwargs):
+    # executor.submit inside a copy of the caller's context, so the deadline follows the work
+    return executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+def request_timeout(seconds=REQUEST_TIMEOUT):
+    # per-request timeout for `requests`, never past the refresh deadline
+    left = remaining()
+    return seconds if left is None else max(0.001, min(seconds, left))
+
+
+def mark_partial(source):
+    current = _deadline.get()
+    if current is not None:
+        current[1].add(source)
+
+
+@contextmanager
+def upstream(source):
+    # METRICS.track plus the source's circuit breaker and the refresh deadline
+    left = remaining()
+    if left is not None and left <= 0:
+        mark_partial(source)
+        raise SourceUnavailable(f"{source}: refresh deadline exceeded")
+    breaker = BREAKERS[source]
+    if not breaker.allow():
+        mark_partial(source)
+        raise SourceUnavailable(f"{source}: circuit open")
+
+    failed = True
+    try:
+        with METRICS.track(source) as request:
+            yield request
+        failed = request.failed
+    except Exception as e:
+        # the source answered but the data was no good (unknown ticker, odd payload): the
+        # caller sees the error, the breaker only counts outages
+        failed = _is_outage(e)
+        raise
+    finally:
+        breaker.record(not failed)
+        if failed:
+            mark_partial(source)
+
+
+def _is_outage(e):
+    # transport errors, timeouts and 5xx answers
+    if isinstance(e, requests.HTTPError):
+        return e.response is None or e.response.status_code >= 500
+    return isinstance(e, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError))
+
+
+def guarded(source):
+    # decorator form of upstream()
+
+    def decorator(func):
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with upstream(source):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def race(*attempts, hedge_delay=HEDGE_DELAY):
+    # attempts are (source, func) in preference order. the first starts right away and each
+    # following one is started once the previous ones have been running for `hedge_delay`
+    # (or failed). the first non-empty result wins; None when nothing answers in time
+    pending = {}
+    for source, _ in attempts:
+        if BREAKERS[source].state == "open":
+            mark_partial(source)
+    attempts = [(s, f) for s, f in attempts if BREAKERS[s].state != "open"]
+    while attempts or pending:
+        if attempts and (not pending or hedge_delay <= 0):
+            source, func = attempts.pop(0)
+            pending[submit(_executor, func)] = source
+            continue
+
+        wait_for = hedge_delay if attempts else remaining()
+        done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+        if not done:
+            if attempts:
+                source, func = attempts.pop(0)
+                pending[submit(_executor, func)] = source
+                continue
+            for source in pending.values():
+                mark_partial(source)
+            return None  # deadline hit with requests still in flight
+
+        for future in done:
+            source = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"{source} failed: {e!r}")
+                continue
+            if result:
+                return result
+    return None
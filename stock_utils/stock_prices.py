@@ -1,38 +1,85 @@
 import os
 import json
+import re
 import sys
-import requests
+from concurrent.futures import ThreadPoolExecutor
 
-from bs4 import BeautifulSoup
+import numpy as np
 import pandas as pd
-from wallstreet import Stock
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from fiat_exchange import FiatEx
-from google_sheet import open_sheet
+from google_sheet import map_sheets, open_sheet, sheet_ids
+from quote_cache import cached_quote
+from metrics import METRICS
+from sources import guarded, request_timeout, submit
+import http_client
+from valuation import CURRENCIES, add_totals, currency_list
+from rates import RateGraph
+from us_quotes import get_us_quotes
+
+NAVER_URL = "https://fchart.stock.naver.com/sise.nhn?symbol={company_ticker_symbol}&timeframe=day&count={lookback}&requestType=0"
+NAVER_ITEM = re.compile(rb'<item\s+data="([^"]*)"')
+OHLCV_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+MAX_WORKERS = 8
+
+
+@cached_quote("naver")
+@guarded("naver")
+def get_kr_ohlcv(company_ticker_symbol, lookback=1):
+    # daily OHLCV for the last `lookback` days from one request, typed and indexed by date
+    url = NAVER_URL.format(company_ticker_symbol=company_ticker_symbol, lookback=lookback)
+
+    response = http_client.get(url, timeout=request_timeout())
+    response.raise_for_status()
+    items = NAVER_ITEM.findall(response.content)
+    if not items:
+        raise ValueError(f"no quotes for {company_ticker_symbol}")
+    # every item is "date|open|high|low|close|volume"; split them all in one go
+    fields = np.array(b"|".join(items).split(b"|")).reshape(len(items), 6)
+
+    df = pd.DataFrame(fields[:, 1:5].astype(np.float64), columns=OHLCV_COLUMNS[:4])
+    df["Volume"] = fields[:, 5].astype(np.int64)
+    df.index = pd.DatetimeIndex(pd.to_datetime(fields[:, 0].astype(str), format="%Y%m%d"), name="Date")
+    return df
 
 
 def get_kr_stock_price(company_ticker_symbol, lookback=1):
-    url_form = "https://fchart.stock.naver.com/sise.nhn?symbol={company_ticker_symbol}&timeframe=day&count={lookback}&requestType=0"
-    url = url_form.format(company_ticker_symbol=company_ticker_symbol, lookback=lookback)
-
-    response = requests.get(url)
-    bs_obj = BeautifulSoup(response.content, "html.parser")
-    bs_res = bs_obj.select('item')
-    informations = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
-    df = pd.DataFrame([], columns=informations, index=range(len(bs_res)))
-
-    for i in range(len(bs_res)):
-        df.iloc[i] = str(bs_res[i]['data']).split('|')
-
-    df['Date'] = pd.to_datetime(df['Date'])
-    return float(df.iloc[-1]['Close'])
+    return float(get_kr_ohlcv(company_ticker_symbol, lookback)["Close"].iloc[-1])
 
 
 def get_us_stock_price(ticker):
-    info = Stock(ticker)
-    return info.price
+    return get_us_quotes([ticker])[ticker]
+
+
+def fetch_stock_prices(subtypes, symbols, max_workers=MAX_WORKERS):
+    # fan out every KR lookup at once next to a single bulk US request; prices come back in
+    # input order, None on failure
+    us_tickers = [s for t, s in zip(subtypes, symbols) if t == "us"]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        us_future = submit(executor, get_us_quotes, us_tickers) if us_tickers else None
+        kr_futures = {
+            i: submit(executor, get_kr_stock_price, s)
+            for i, (t, s) in enumerate(zip(subtypes, symbols))
+            if t == "kr"
+        }
+
+    try:
+        us_quotes = us_future.result() if us_future is not None else {}
+    except Exception:
+        us_quotes = {}
+
+    prices = []
+    for i, (t, s) in enumerate(zip(subtypes, symbols)):
+        if t == "us":
+            prices.append(us_quotes.get(s))
+            continue
+        try:
+            prices.append(kr_futures[i].result())
+        except:
+            prices.append(None)
+    return prices
 
 
 def open_assets(path):
@@ -41,69 +88,75 @@ def open_assets(path):
     return assets
 
 
-def main(sheet_id=None, return_data=False):
-    if sheet_id is None:
-        sheet_id = os.environ.get("ASSET_GOOGLE_SHEET_ID", None)
-        if sheet_id is None:
-            raise ValueError("sheet_id is not provided")
+def value_stocks(assets, graph, max_workers=MAX_WORKERS, known=None, currencies=()):
+    # typed float64 valuation indexed by asset: amount, krw, usd, price (KRW for kr, USD for us),
+    # plus a column per extra currency, all from one RateGraph resolve (graph holds the fx).
+    # failed quotes fall back to zero prices; assets in known ({asset: price}) are not fetched
+    known = known or {}
+    assets = assets[assets["SUBTYPE"].isin(["kr", "us"])]
+    subtype = assets["SUBTYPE"].to_numpy()
+    is_us = subtype == "us"
+    tickers = assets["TICKER"].astype(str).str.replace("\"", "")
+    symbols = np.where(is_us, assets["ASSET"], tickers)
+    amount = assets["AMOUNT"].to_numpy(dtype="float64")
+
+    price = np.array([known.get(a, np.nan) for a in assets["ASSET"]], dtype="float64")
+    stale = np.isnan(price)
+    prices = fetch_stock_prices(subtype[stale], symbols[stale], max_workers=max_workers)
+    price[stale] = [np.nan if p is None else p for p in prices]
+    failed = np.isnan(price)
+    for asset, ticker, us in zip(assets["ASSET"][failed], tickers[failed], is_us[failed]):
+        print(f'Failed to get {asset} price' if us else f'Failed to get {asset} ({ticker}) price')
+    price[failed] = 0
+
+    for asset, p, us in zip(assets["ASSET"], price, is_us):
+        graph.add(asset, "USD" if us else "KRW", p)
+    currencies = ["KRW", "USD", *[c for c in currencies if c not in ("KRW", "USD")]]
+    rates = graph.rates(currencies).reindex(assets["ASSET"]).fillna(0).to_numpy()
+    values = amount[:, None] * rates
+    df = pd.DataFrame(
+        {
+            "amount": amount,
+            "krw": values[:, 0],
+            "usd": values[:, 1],
+            "price": price,
+            **{c.lower(): values[:, i] for i, c in enumerate(currencies) if i > 1},
+        },
+        index=pd.Index(assets["ASSET"].to_numpy(), name="symbol"),
+    )
+    df.attrs["missing"] = list(assets["ASSET"][failed])
+    return df
+
+
+def main(sheet_id=None, return_data=False, max_workers=MAX_WORKERS, assets=None, known=None,
+         currencies=CURRENCIES):
+    # currencies: extra reporting currencies, "EUR,JPY" on the command line
+    currencies = [c for c in currency_list(currencies) if c not in ("KRW", "USD")]
+    if assets is None:
+        ids = sheet_ids(sheet_id)
+        if len(ids) > 1:
+            # {sheet_id: frame} with return_data
+            return map_sheets(main, ids, return_data, max_workers=max_workers, currencies=currencies)
+        assets = open_sheet(ids[0])
     pd.options.display.float_format = '{:,.2f}'.format
-    forex = FiatEx()
+    with METRICS.span("stock.fx"):
+        graph = RateGraph()
+        graph.add_fiat(FiatEx())
 
-    usd2krw = forex.get_fiat_fx("USD", "KRW")
-
-    assets = open_sheet(sheet_id)
     assets = assets[assets["CLASS"] == "stock"]
-    investment_krw = assets[assets["SUBTYPE"] == "inv"]["AMOUNT"]
+    investment_krw = float(assets[assets["SUBTYPE"] == "inv"]["AMOUNT"].sum())
 
-    data = {}
-    for i, row in assets.iterrows():
-        asset = row["ASSET"]
-        amount = row["AMOUNT"]
-        if row["SUBTYPE"] == "inv":
-            continue
-        if row["SUBTYPE"] == "kr":
-            ticker = row["TICKER"].replace("\"", "")
-            try:
-                krw_price = get_kr_stock_price(ticker)
-                data[asset] = {
-                    "amount": amount,
-                    "krw": amount * krw_price,
-                    "usd": "",
-                    "price": krw_price,
-                }
-            except:
-                print(f'Failed to get {asset} ({ticker}) price')
-                data[asset] = {"amount": amount, "krw": 0, "usd": 0, "price": 0}
-
-        elif row["SUBTYPE"] == "us":
-            try:
-                usd_price = get_us_stock_price(asset)
-                usd_amount = amount * usd_price
-                data[asset] = {
-                    "amount": amount,
-                    "krw": usd_amount * usd2krw,
-                    "usd": usd_amount,
-                    "price": usd_price,
-                }
-            except:
-                print(f'Failed to get {asset} price')
-                data[asset] = {"amount": amount, "krw": 0, "usd": 0, "price": 0}
-    df = pd.DataFrame(data)
-    df['TOTAL'] = ["", df.loc["krw"].sum(), "", ""]
-    df["INVESTMENT"] = ["", investment_krw, 0, ""]
-    df['PROFIT'] = ["", df['TOTAL']['krw'] - investment_krw, "", ""]
-    df = df.T
-    df['symbol'] = df.index
-    # set symbol to first column
-    cols = df.columns.tolist()
-    cols = cols[-1:] + cols[:-1]
-    df = df[cols]
+    with METRICS.span("stock.valuation"):
+        df = value_stocks(assets, graph, max_workers=max_workers, known=known, currencies=currencies)
+        df = add_totals(df, investment_krw, currencies)
 
     if return_data:
         return df
     else:
-        print(df.drop(columns=['symbol']))
+        print(df.drop(columns=['symbol']).to_string(na_rep=""))
 
 
 if __name__ == '__main__':
-    main()
+    import fire
+
+    fire.Fire(main)
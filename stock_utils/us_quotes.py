@@ -0,0 +1,157 @@
+import abc
+import os
+
+import pandas as pd
+
+from sources import request_timeout, upstream
+import http_client
+from quote_cache import QUOTE_CACHE, QUOTE_FLIGHTS
+
+YAHOO_QUOTE_URL = "https://query1.finance.yahoo.com/v7/finance/quote"
+YAHOO_CHART_URL = "https://query1.finance.yahoo.com/v8/finance/chart/{}"
+YAHOO_HEADERS = {"User-Agent": "Mozilla/5.0"}
+MAX_SYMBOLS = 50  # tickers per yahoo quote request
+CACHE_SOURCE = "us_equity"
+
+Stock = None  # wallstreet.Stock, imported on first use: it drags in scipy
+
+
+class QuoteProvider(abc.ABC):
+    # get_quotes(tickers) -> {ticker: price}; tickers the backend can't price are left out
+    name = None
+
+    @abc.abstractmethod
+    def get_quotes(self, tickers):
+        ...
+
+
+class YahooQuoteProvider(QuoteProvider):
+    name = "yahoo"
+
+    def get_quotes(self, tickers):
+        quotes = {}
+        for i in range(0, len(tickers), MAX_SYMBOLS):
+            chunk = tickers[i:i + MAX_SYMBOLS]
+            with upstream("yahoo") as request:
+                response = http_client.get(YAHOO_QUOTE_URL,
+                                           params={"symbols": ",".join(chunk)},
+                                           headers=YAHOO_HEADERS,
+                                           timeout=request_timeout())
+                if response.status_code != 200:
+                    request.fail()
+            if response.status_code != 200:
+                continue
+            for quote in response.json()["quoteResponse"]["result"]:
+                price = quote.get("regularMarketPrice")
+                if price is not None:
+                    quotes[quote["symbol"]] = float(price)
+        return quotes
+
+
+class WallstreetQuoteProvider(QuoteProvider):
+    # one scrape per ticker; kept as the fallback for whatever the bulk backend misses
+    name = "wallstreet"
+
+    def get_quotes(self, tickers):
+        global Stock
+        if Stock is None:
+            from wallstreet import Stock
+        quotes = {}
+        for ticker in tickers:
+            try:
+                with upstream("wallstreet"):
+                    quotes[ticker] = float(Stock(ticker).price)
+            except Exception:
+                pass
+        return quotes
+
+
+class FallbackQuoteProvider(QuoteProvider):
+
+    def __init__(self, *providers) -> None:
+        self.providers = providers
+        self.name = "+".join(p.name for p in providers)
+
+    def get_quotes(self, tickers):
+        quotes = {}
+        remaining = list(tickers)
+        for provider in self.providers:
+            if not remaining:
+                break
+            try:
+                quotes.update(provider.get_quotes(remaining))
+            except Exception as e:
+                print(f"{provider.name} quotes failed: {e!r}")
+            remaining = [t for t in remaining if t not in quotes]
+        return quotes
+
+
+class StaticQuoteProvider(QuoteProvider):
+    # fixed prices, no network; records every request so tests can assert on batching
+    name = "static"
+
+    def __init__(self, prices) -> None:
+        self.prices = dict(prices)
+        self.requests = []
+
+    def get_quotes(self, tickers):
+        self.requests.append(list(tickers))
+        return {t: self.prices[t] for t in tickers if t in self.prices}
+
+
+BACKENDS = {
+    "yahoo": lambda: FallbackQuoteProvider(YahooQuoteProvider(), WallstreetQuoteProvider()),
+    "wallstreet": WallstreetQuoteProvider,
+}
+
+_provider = None
+
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        _provider = BACKENDS[os.environ.get("US_QUOTE_BACKEND", "yahoo")]()
+    return _provider
+
+
+def set_provider(provider):
+    global _provider
+    _provider = provider
+
+
+def get_us_quotes(tickers, provider=None):
+    # cached bulk lookup: only tickers without a fresh quote reach the provider, in one call
+    quotes = {}
+    for ticker in dict.fromkeys(tickers):
+        price = QUOTE_CACHE.get(CACHE_SOURCE, ticker)
+        if price is not None:
+            quotes[ticker] = price
+    missing = [t for t in dict.fromkeys(tickers) if t not in quotes]
+
+    def fetch(tickers):
+        fetched = (provider or get_provider()).get_quotes(tickers)
+        for ticker, price in fetched.items():
+            QUOTE_CACHE.set(CACHE_SOURCE, ticker, price)
+        return fetched
+
+    if missing:
+        # tickers another portfolio is already fetching are waited for, not requested again
+        quotes.update(QUOTE_FLIGHTS.do_many(CACHE_SOURCE, missing, fetch))
+    return quotes
+
+
+def get_us_history(ticker, start, end):
+    # daily closes (USD) between two dates from the yahoo chart endpoint, indexed by date
+    period = [int(pd.Timestamp(d).timestamp()) for d in (start, pd.Timestamp(end) + pd.Timedelta(days=1))]
+    with upstream("yahoo") as request:
+        response = http_client.get(YAHOO_CHART_URL.format(ticker),
+                                   params={"period1": period[0], "period2": period[1], "interval": "1d"},
+                                   headers=YAHOO_HEADERS,
+                                   timeout=request_timeout())
+        if response.status_code != 200:
+            request.fail()
+    response.raise_for_status()
+    result = response.json()["chart"]["result"][0]
+    closes = pd.Series(result["indicators"]["quote"][0]["close"], dtype="float64",
+                       index=pd.to_datetime(result.get("timestamp", []), unit="s").normalize())
+    return closes[~closes.index.duplicated(keep="last")].dropna().rename_axis("Date")
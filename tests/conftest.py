@@ -0,0 +1,8 @@
+import os
+import sys
+
+# modules live at the repo root and in crypto_utils / stock_utils, which import each other by name
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "crypto_utils"), os.path.join(ROOT, "stock_utils")):
+    if path not in sys.path:
+        sys.path.append(path)
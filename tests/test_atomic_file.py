@@ -0,0 +1,33 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from atomic_file import replace_file
+
+
+def _write_many(path):
+    for i in range(50):
+        with replace_file(path) as f:
+            json.dump({"writer": os.getpid(), "i": i, "pad": "x" * 10000}, f)
+
+
+def test_concurrent_writers_never_leave_a_partial_file(tmp_path):
+    path = str(tmp_path / "index.json")
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(_write_many, [path] * 4))
+    with open(path) as f:
+        assert json.load(f)["i"] == 49
+    assert os.listdir(tmp_path) == ["index.json"]
+
+
+def test_failed_write_keeps_the_old_file(tmp_path):
+    path = tmp_path / "index.json"
+    path.write_text("old")
+    with pytest.raises(RuntimeError):
+        with replace_file(str(path)) as f:
+            f.write("half")
+            raise RuntimeError("disk full")
+    assert path.read_text() == "old"
+    assert os.listdir(tmp_path) == ["index.json"]
@@ -0,0 +1,72 @@
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import fiat_exchange
+
+CURRENCIES = ["USD", "KRW", "EUR"]
+LAST = datetime.date(2024, 3, 1)  # a friday
+TODAY = datetime.date(2024, 3, 12)
+
+
+def _fixings(days):
+    # business days after LAST up to TODAY, usd = 1.0 + day of month / 100
+    dates = [TODAY - datetime.timedelta(days=d) for d in range(days)]
+    dates = [d for d in dates if d.weekday() < 5 and d > LAST]
+    rates = np.array([[1 + d.day / 100, 1400 + d.day] for d in dates])
+    return dates, ["USD", "KRW"], rates
+
+
+def _store(tmp_path, monkeypatch):
+    fx = fiat_exchange.FiatEx.__new__(fiat_exchange.FiatEx)
+    fx.rates_path = str(tmp_path / "ecb-rates.npy")
+    fx.meta_path = str(tmp_path / "ecb-rates.json")
+    fx._save(LAST - datetime.timedelta(days=9), CURRENCIES, np.tile([1.5, 1350.0, 1.0], (10, 1)))
+
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        return _fixings(1) if url == fx.daily_url else _fixings(90)
+
+    monkeypatch.setattr(fx, "_fetch", fetch)
+    monkeypatch.setattr(fx, "_build", lambda: fetched.append(fx.url))
+    return fx, fetched
+
+
+def test_missed_business_days_get_their_own_fixings(tmp_path, monkeypatch):
+    fx, fetched = _store(tmp_path, monkeypatch)
+    fx._update()
+    fx.load()
+
+    assert fetched == [fx.daily_url, fx.recent_url]
+    assert fx.get_fiat_fx("EUR", "USD", "2024-03-05") == 1.05  # a tuesday the daily file skipped
+    assert fx.get_fiat_fx("EUR", "KRW", "2024-03-11") == 1411
+    assert fx.get_fiat_fx("EUR", "USD", "2024-03-10") == 1.08  # sunday keeps friday's fixing
+    assert fx.get_fiat_fx("EUR", "USD", "2024-03-01") == 1.5  # stored rows are untouched
+    assert fx.get_fiat_fx("EUR", "EUR", "2024-03-12") == 1.0
+    assert fx.rate["USD"] == 1.12
+
+
+def test_long_gaps_rebuild_the_history(tmp_path, monkeypatch):
+    fx, fetched = _store(tmp_path, monkeypatch)
+    monkeypatch.setattr(fx, "max_gap", 5)
+    fx._update()
+    assert fetched == [fx.daily_url, fx.url]
+
+
+def _save_many(directory):
+    fx = fiat_exchange.FiatEx.__new__(fiat_exchange.FiatEx)
+    fx.rates_path = os.path.join(directory, "ecb-rates.npy")
+    fx.meta_path = os.path.join(directory, "ecb-rates.json")
+    for _ in range(20):
+        fx._save(LAST, CURRENCIES, np.tile([1.1, 1400.0, 1.0], (500, 1)))
+
+
+def test_concurrent_saves_from_several_processes(tmp_path):
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(_save_many, [str(tmp_path)] * 4))
+    assert sorted(os.listdir(tmp_path)) == ["ecb-rates.json", "ecb-rates.npy"]
+    assert np.load(tmp_path / "ecb-rates.npy").shape == (500, 3)
@@ -0,0 +1,92 @@
+import math
+from types import SimpleNamespace
+
+import live
+from live import LiveFeed, LiveView, PriceBoard
+
+NAN = math.nan
+
+
+def _records(stock_total_usd):
+    return [
+        {"class": "crypto", "symbol": "ETH", "amount": 2.0, "price": 2000.0, "krw": 5.2e6, "usd": 4000.0},
+        {"class": "crypto", "symbol": "TOTAL", "krw": 5.2e6, "usd": 4000.0},
+        {"class": "crypto", "symbol": "PROFIT", "krw": 2e5, "usd": NAN},
+        {"class": "stock", "symbol": "005930", "amount": 10.0, "price": 70000.0, "krw": 7e5, "usd": NAN},
+        {"class": "stock", "symbol": "TOTAL", "krw": 7e5, "usd": stock_total_usd},
+        {"class": "stock", "symbol": "PROFIT", "krw": 1e5, "usd": NAN},
+    ]
+
+
+def _patch(records, key, price):
+    view = LiveView(records, SimpleNamespace(usd2krw=1300.0, assets=None))
+    board = PriceBoard()
+    board.update(key, price)
+    cells, _ = view.patch(board, 0)
+    return cells
+
+
+def test_blank_total_usd_stays_blank():
+    cells = _patch(_records(NAN), ("stock", "005930"), 71000.0)
+    assert cells[(4, "krw")] == 710000.0
+    assert (4, "usd") not in cells
+    assert (5, "usd") not in cells
+
+
+def test_shown_total_usd_follows_prices():
+    cells = _patch(_records(4000.0), ("crypto", "ETH"), 2100.0)
+    assert cells[(1, "usd")] == 4200.0
+    assert cells[(1, "krw")] == 4200.0 * 1300.0
+    assert (2, "usd") not in cells
+
+
+class _Refresher:
+
+    def __init__(self, snapshot) -> None:
+        self.sheet_id = "sheet"
+        self.snapshot = snapshot
+        self.refreshed = 0
+
+    def latest(self):
+        return self.snapshot
+
+    def refresh(self):
+        self.refreshed += 1
+        return self.snapshot
+
+
+def test_poll_reprices_without_refreshing(monkeypatch):
+    stale = SimpleNamespace(age=600, assets="rows", holdings=None)
+    polled = SimpleNamespace(holdings={"class": ["crypto"], "symbol": ["TAO"], "price": [400.0]}, missing=[])
+    calls = []
+
+    def build(sheet_id, previous, assets, max_age):
+        calls.append((sheet_id, previous, assets, max_age))
+        return polled
+
+    monkeypatch.setattr(live, "build_snapshot", build)
+    refresher = _Refresher(stale)
+    feed = LiveFeed([refresher], pairs=(), poll_interval=30)
+    feed.poll()
+
+    assert calls == [("sheet", stale, "rows", 30)]
+    assert refresher.refreshed == 0  # no sheet download, no history row
+    assert feed.board.get(("crypto", "TAO")) == 400.0
+
+
+def test_feed_stops_without_live_browsers(monkeypatch):
+    monkeypatch.setattr(LiveFeed, "poll", lambda self: None)
+    feed = LiveFeed([], pairs=(), poll_interval=0.01, idle_timeout=0.05).start()
+    thread = feed._thread
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert not feed.running
+    assert feed.start().running
+
+
+def test_extra_currency_columns_follow_usd():
+    records = [{**r, "eur": None if math.isnan(r["usd"]) else r["usd"] * 0.9} for r in _records(NAN)]
+    cells = _patch(records, ("crypto", "ETH"), 2100.0)
+    assert cells[(0, "eur")] == 4200.0 * 0.9
+    assert cells[(1, "eur")] == 4200.0 * 0.9
+    assert (4, "eur") not in cells
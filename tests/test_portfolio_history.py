@@ -0,0 +1,19 @@
+import pandas as pd
+
+from portfolio_history import PortfolioHistory
+
+
+def _holdings(price):
+    return pd.DataFrame({"symbol": ["ETH"], "class": ["crypto"], "amount": [2.0], "price": [price],
+                         "krw": [2.0 * price], "usd": [None]})
+
+
+def test_asset_pnl_keeps_portfolios_apart(tmp_path):
+    history = PortfolioHistory(str(tmp_path / "history.db"))
+    for ts, (a, b) in enumerate([(100.0, 1000.0), (110.0, 900.0), (120.0, 950.0)]):
+        history.append(_holdings(a), 2 * a, 100, 1300, scope="sheet-a", ts=1000 + ts)
+        history.append(_holdings(b), 2 * b, 100, 1300, scope="sheet-b", ts=1000 + ts)
+
+    assert history.asset_pnl(scope="sheet-a")["ETH"].tolist() == [0.0, 20.0, 40.0]
+    assert history.asset_pnl(scope="sheet-b")["ETH"].tolist() == [0.0, -200.0, -100.0]
+    assert history.asset_pnl().empty
@@ -0,0 +1,124 @@
+import math
+
+import pandas as pd
+import pytest
+
+from rates import RateGraph
+
+
+def test_direct_quote_beats_longer_route_added_first():
+    graph = RateGraph()
+    graph.add("TKN", "WETH", 0.001)
+    graph.add("WETH", "ETH", 1.0)
+    graph.add("ETH", "USD", 3000.0)
+    graph.add("TKN", "USD", 2.5)
+    assert graph.resolve()["TKN"] == pytest.approx(2.5)
+
+
+def test_earlier_edge_wins_at_the_same_distance():
+    graph = RateGraph()
+    graph.add("TKN", "USD", 2.0)
+    graph.add("TKN", "USD", 3.0)
+    assert graph.resolve()["TKN"] == pytest.approx(2.0)
+
+
+def test_unconnected_node_is_nan():
+    graph = RateGraph()
+    graph.add("TKN", "USD", 2.0)
+    graph.add("FOO", "BAR", 5.0)
+    prices = graph.resolve()
+    assert math.isnan(prices["FOO"])
+    assert math.isnan(prices["BAR"])
+    assert math.isnan(graph.rates(["USD", "XYZ"]).loc["TKN", "XYZ"])
+
+
+def test_edges_are_used_inverted():
+    graph = RateGraph()
+    graph.add("EUR", "USD", 1.1)
+    graph.add("EUR", "KRW", 1540.0)
+    rates = graph.rates(["USD", "KRW", "EUR"])
+    assert rates.loc["KRW", "USD"] == pytest.approx(1.1 / 1540.0)
+    assert rates.loc["USD", "KRW"] == pytest.approx(1400.0)
+    assert rates.loc["USD", "EUR"] == pytest.approx(1 / 1.1)
+    assert rates.loc["EUR", "EUR"] == pytest.approx(1.0)
+
+
+def test_invalid_rates_are_ignored():
+    graph = RateGraph()
+    for rate in (None, 0, -1.0, float("nan"), float("inf")):
+        graph.add("TKN", "USD", rate)
+    graph.add("USD", "USD", 2.0)
+    assert graph.edges == []
+    assert list(graph.resolve().index) == ["USD"]
+
+
+def test_has_price_ignores_quote_side():
+    graph = RateGraph()
+    graph.add_dex("AGENT", {"VIRTUAL": {"native": 0.05, "usd": 0.075}})
+    assert graph.has_price("AGENT")
+    assert not graph.has_price("VIRTUAL")
+
+
+class FakeCex:
+    # CryptoEx with canned batched dexscreener quotes and no upstreams
+    def __init__(self, dex_prices, fallback=None):
+        self.address_book = {s: {"ADDRESS": f"0x{s.lower()}", "DECIMALS": 18} for s in dex_prices}
+        self.dex_prices = {f"0x{s.lower()}": p for s, p in dex_prices.items()}
+        self.fallback = fallback or {}
+        self.asked = []
+
+    def get_crypto_fx(self, symbol1, symbol2):
+        self.asked.append((symbol1, symbol2))
+        return self.fallback.get((symbol1, symbol2), 0)
+
+
+def _holdings(*symbols):
+    return pd.DataFrame({"ASSET": list(symbols), "AMOUNT": [1.0] * len(symbols)})
+
+
+def _graph():
+    graph = RateGraph()
+    graph.add("EUR", "USD", 1.1)
+    graph.add("EUR", "KRW", 1540.0)
+    graph.add_stablecoins()
+    graph.add("ETH", "USD", 3000.0)
+    return graph
+
+
+def test_holding_quoted_by_another_token_gets_its_own_price():
+    from my_crypto import value_crypto
+
+    # AGENT trades against VIRTUAL; that pair's cross rate must not price VIRTUAL itself
+    cex = FakeCex({
+        "AGENT": {"VIRTUAL": {"native": 0.05, "usd": 0.075}},
+        "VIRTUAL": {"WETH": {"native": 1 / 3000, "usd": 1.0}},
+    })
+    df = value_crypto(_holdings("AGENT", "VIRTUAL"), cex, _graph())
+    assert df.loc["VIRTUAL", "price"] == pytest.approx(1.0)
+    assert df.loc["AGENT", "price"] == pytest.approx(0.075)
+    assert df.loc["VIRTUAL", "krw"] == pytest.approx(1400.0)
+    assert cex.asked == []
+
+
+def test_holding_without_batched_quote_uses_fallback():
+    from my_crypto import value_crypto
+
+    cex = FakeCex({"AGENT": {"VIRTUAL": {"native": 0.05, "usd": 0.075}}, "VIRTUAL": None},
+                  fallback={("VIRTUAL", "USDT"): 1.0})
+    df = value_crypto(_holdings("AGENT", "VIRTUAL"), cex, _graph())
+    assert cex.asked == [("VIRTUAL", "USDT")]
+    assert df.loc["VIRTUAL", "price"] == pytest.approx(1.0)
+    assert df.attrs["missing"] == []
+
+
+def test_extra_currencies_are_valued_and_totalled():
+    from my_crypto import value_crypto
+    from valuation import add_totals, currency_list
+
+    cex = FakeCex({"VIRTUAL": {"WETH": {"native": 1 / 3000, "usd": 1.0}}})
+    currencies = currency_list("eur, ")
+    df = add_totals(value_crypto(_holdings("VIRTUAL", "ETH"), cex, _graph(), known={"VIRTUAL": 2.2},
+                                 currencies=currencies), 0.0, currencies)
+    assert df.loc["VIRTUAL", "eur"] == pytest.approx(2.0)
+    assert df.loc["ETH", "eur"] == pytest.approx(3000 / 1.1)
+    assert df.loc["TOTAL", "eur"] == pytest.approx(2.0 + 3000 / 1.1)
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+import revalue
+
+ASSETS = pd.DataFrame({
+    "CLASS": ["crypto", "crypto", "stock", "stock", "cash"],
+    "SUBTYPE": ["dex", "dex", "kr", "us", "inv"],
+    "ASSET": ["ETH", "NEW", "005930", "AAPL", "investment"],
+    "AMOUNT": [1.0, 2.0, 3.0, 0.0, 100.0],
+    "TICKER": ["", "", "\"005930\"", "AAPL", ""],
+})
+FOREX = SimpleNamespace(get_fiat_fx_series=lambda fiat1, fiat2, dates: np.full(len(dates), 1000.0))
+
+
+def _history(kind, key, dates):
+    if key == "NEW":  # listed mid-range
+        return pd.Series([5.0], index=[pd.Timestamp("2024-01-03")])
+    if key == "AAPL":
+        raise ValueError("no chart")
+    return pd.Series(10.0, index=dates)
+
+
+def test_totals_are_empty_while_a_holding_has_no_price(monkeypatch):
+    monkeypatch.setattr(revalue, "_history", _history)
+    df = revalue.revalue(ASSETS, revalue._dates("2024-01-01", "2024-01-05"), forex=FOREX, max_workers=1)
+
+    assert df["total_krw"].isna().tolist() == [True, True, False, False, False]
+    assert df["missing"].tolist() == ["NEW", "NEW", "", "", ""]
+    assert df["stock_krw"].iloc[0] == 30.0  # AAPL has no history but none is held
+    assert df["total_krw"].iloc[-1] == 10 * 1000 + 2 * 5 * 1000 + 30
+    assert df.attrs["missing"] == []
+
+
+def test_missing_survives_json(monkeypatch, tmp_path):
+    monkeypatch.setattr(revalue, "_history", _history)
+    df = revalue.revalue(ASSETS, revalue._dates("2024-01-01", "2024-01-02"), forex=FOREX, max_workers=1)
+    df.reset_index().to_json(tmp_path / "history.json", orient="records", date_format="iso")
+    assert pd.read_json(tmp_path / "history.json")["missing"].tolist() == ["NEW", "NEW"]
@@ -0,0 +1,44 @@
+from send_discord import Notifier
+
+
+def _stalled(maxsize):
+    notifier = Notifier(webhook="http://localhost/unused", maxsize=maxsize)
+    notifier._thread = object()  # nothing drains the queue
+    return notifier
+
+
+def test_duplicates_are_suppressed():
+    notifier = _stalled(2)
+    assert notifier.send("TAO: $400")
+    assert not notifier.send("TAO: $400")
+    assert notifier.queue.qsize() == 1
+
+
+def test_dropped_messages_can_be_sent_again():
+    notifier = _stalled(1)
+    assert notifier.send("first")
+    assert not notifier.send("second")  # queue full
+    notifier.queue.get_nowait()
+    assert notifier.send("second")
+
+
+def test_rejected_batch_does_not_drop_the_rest(monkeypatch):
+    import requests
+
+    import send_discord
+
+    posted = []
+
+    def post(url, json, timeout):
+        posted.append(json["content"])
+        response = requests.Response()
+        response.status_code = 400 if json["content"] == "bad" else 204
+        response._content = b""
+        return response
+
+    monkeypatch.setattr(send_discord.http_client, "post", post)
+    monkeypatch.setattr(send_discord, "MAX_LENGTH", 3)  # one message per batch
+    notifier = Notifier(webhook="http://localhost/unused")
+    for content in notifier._batches(["bad", "ok"]):
+        notifier._post(content)
+    assert posted == ["bad", "ok"]
@@ -0,0 +1,43 @@
+import pytest
+import requests
+
+from sources import BREAKERS, SourceUnavailable, guarded
+
+
+def _failing(source, error):
+
+    @guarded(source)
+    def call():
+        raise error
+
+    return call
+
+
+def test_data_errors_leave_the_breaker_closed():
+    call = _failing("test-data", ValueError("no quotes for 000000"))
+    for _ in range(BREAKERS["test-data"].threshold + 1):
+        with pytest.raises(ValueError):
+            call()
+    assert BREAKERS["test-data"].state == "closed"
+
+
+def test_client_errors_leave_the_breaker_closed():
+    response = requests.Response()
+    response.status_code = 404
+    call = _failing("test-4xx", requests.HTTPError(response=response))
+    for _ in range(BREAKERS["test-4xx"].threshold + 1):
+        with pytest.raises(requests.HTTPError):
+            call()
+    assert BREAKERS["test-4xx"].state == "closed"
+
+
+@pytest.mark.parametrize("error", [requests.ConnectionError(), requests.Timeout(), TimeoutError()])
+def test_outages_open_the_breaker(error):
+    source = f"test-{type(error).__name__}"
+    call = _failing(source, error)
+    for _ in range(BREAKERS[source].threshold):
+        with pytest.raises(type(error)):
+            call()
+    assert BREAKERS[source].state == "open"
+    with pytest.raises(SourceUnavailable):
+        call()
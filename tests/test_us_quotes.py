@@ -0,0 +1,51 @@
+import json
+
+import pytest
+import requests
+
+import us_quotes
+from quote_cache import QUOTE_CACHE
+from us_quotes import FallbackQuoteProvider, StaticQuoteProvider, YahooQuoteProvider, get_us_quotes, set_provider
+
+
+@pytest.fixture(autouse=True)
+def _no_cached_quotes():
+    QUOTE_CACHE.clear(us_quotes.CACHE_SOURCE)
+    yield
+    QUOTE_CACHE.clear(us_quotes.CACHE_SOURCE)
+
+
+def test_one_provider_call_for_uncached_tickers(monkeypatch):
+    monkeypatch.setattr(us_quotes, "_provider", None)  # restored after the test
+    provider = StaticQuoteProvider({"AAPL": 190.0, "MSFT": 410.0, "NVDA": 120.0})
+    set_provider(provider)
+    assert get_us_quotes(["AAPL", "MSFT", "AAPL"]) == {"AAPL": 190.0, "MSFT": 410.0}
+    assert get_us_quotes(["AAPL", "NVDA"]) == {"AAPL": 190.0, "NVDA": 120.0}
+    assert provider.requests == [["AAPL", "MSFT"], ["NVDA"]]
+
+
+def test_fallback_only_gets_what_the_bulk_backend_missed():
+    bulk = StaticQuoteProvider({"AAPL": 190.0})
+    fallback = StaticQuoteProvider({"BRK-B": 450.0, "MSFT": 1.0})
+    quotes = get_us_quotes(["AAPL", "BRK-B", "GONE"], provider=FallbackQuoteProvider(bulk, fallback))
+    assert quotes == {"AAPL": 190.0, "BRK-B": 450.0}
+    assert bulk.requests == [["AAPL", "BRK-B", "GONE"]]
+    assert fallback.requests == [["BRK-B", "GONE"]]
+
+
+def test_yahoo_requests_at_most_max_symbols_at_once(monkeypatch):
+    chunks = []
+
+    def get(url, params, headers, timeout):
+        symbols = params["symbols"].split(",")
+        chunks.append(len(symbols))
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps({"quoteResponse": {"result": [
+            {"symbol": s, "regularMarketPrice": 1.0} for s in symbols]}}).encode()
+        return response
+
+    monkeypatch.setattr(us_quotes.http_client, "get", get)
+    tickers = [f"T{i}" for i in range(2 * us_quotes.MAX_SYMBOLS + 1)]
+    assert len(get_us_quotes(tickers, provider=YahooQuoteProvider())) == len(tickers)
+    assert chunks == [us_quotes.MAX_SYMBOLS, us_quotes.MAX_SYMBOLS, 1]
@@ -0,0 +1,36 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+VALUE_COLUMNS = ["amount", "krw", "usd", "price"]
+SUMMARY_ROWS = ["TOTAL", "INVESTMENT", "PROFIT"]
+
+
+def currency_list(currencies):
+    # "EUR,JPY" (env / CLI) or a sequence of codes -> ["EUR", "JPY"]
+    if isinstance(currencies, str):
+        currencies = currencies.split(",")
+    return [c.strip().upper() for c in currencies if c.strip()]
+
+
+# currencies every valuation is reported in besides KRW / USD, a lowercase column each
+CURRENCIES = currency_list(os.environ.get("ASSET_CURRENCIES", ""))
+
+
+def add_totals(df, investment_krw, currencies=()):
+    # append TOTAL / INVESTMENT / PROFIT rows to a typed valuation frame; blanks are NaN
+    total_krw = df["krw"].sum()
+    totals = {c: df[c].sum() if df[c].notna().all() else np.nan
+              for c in ["usd", *(c.lower() for c in currencies)] if c in df}
+    summary = pd.DataFrame(
+        {
+            "krw": [total_krw, investment_krw, total_krw - investment_krw],
+            **{c: [total, np.nan, np.nan] for c, total in totals.items()},
+        },
+        index=pd.Index(SUMMARY_ROWS, name=df.index.name),
+    )
+    out = pd.concat([df, summary.reindex(columns=df.columns)]).astype("float64")
+    out.attrs = dict(df.attrs)
+    out.insert(0, "symbol", out.index)
+    return out